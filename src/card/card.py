@@ -1,4 +1,6 @@
 #!/usr/bin/python
+from typing import Optional
+
 import PIL.Image
 
 from layer.card_layer import CardLayer
@@ -6,9 +8,11 @@ from util.placement import Placement
 
 
 class Card:
-    def __init__(self, w: int, h: int):
+    # base is an optional pre-rendered image the layers are rendered onto
+    def __init__(self, w: int, h: int, base: Optional[PIL.Image.Image] = None):
         self._w = w
         self._h = h
+        self._base = base
         self._layers: list[CardLayer] = list()
 
     def get_placement(self) -> Placement:
@@ -20,8 +24,18 @@ class Card:
     def add_layers(self, layers: list[CardLayer]):
         self._layers.extend(layers)
 
+    def get_image_names(self) -> list[str]:
+        return [n for layer in self._layers for n in layer.get_image_names()]
+
+    def get_font_files(self) -> list[str]:
+        return [f for layer in self._layers for f in layer.get_font_files()]
+
     def render(self) -> PIL.Image.Image:
-        image = PIL.Image.new("RGBA", (int(self._w), int(self._h)))
+        image = (
+            self._base.copy()
+            if self._base is not None
+            else PIL.Image.new("RGBA", (int(self._w), int(self._h)))
+        )
 
         for layer in self._layers:
             layer.render(image)
@@ -1,16 +1,40 @@
 #!/usr/bin/python
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+import PIL.Image
 
 from card.card import Card
+from layer.card_layer import CardLayer
 from layer.card_layer_factory import CardLayerFactory
+from layer.flattened_card_layer import FlattenedCardLayer
 from layer.image_card_layers import BasicImageLayer
-from provider.input_provider import InputProviderFactory
+from param.config_enums import CardLayerType
+from provider.input_provider import InputProvider, InputProviderFactory
+from util.font_cache import FontCache
 from util.helpers import Helpers as h
 from util.placement import Placement
 
+_STATIC_LAYER_TYPES = [CardLayerType.STATIC_IMAGE, CardLayerType.STATIC_TEXT]
+# decklist columns that don't change how a card looks
+_NON_RENDERED_PROPS = ["count", "skip"]
+
 
 class CardBuilder:
-    def __init__(self, config: dict):
-        self._input_provider = InputProviderFactory.build(config)
+    @dataclass
+    class CardTemplate:
+        # leading static layers, rendered once
+        plate: Optional[PIL.Image.Image]
+        # the layers rendered into the plate
+        plate_layers: list[CardLayer]
+        # configs of dynamic layers, built per card, or static layers built
+        # once and shared by every card of the type, flattened when exact
+        runs: list[list[dict] | CardLayer]
+
+    def __init__(self, config: dict, input_provider: Optional[InputProvider] = None):
+        self._input_provider = input_provider or InputProviderFactory.build(config)
 
         self._default_type = h.require(config, "default_card_type")
         self._specs = h.require(config, "card_specs")
@@ -21,18 +45,51 @@ class CardBuilder:
         self._h = h.require(config, "h")
 
         self._config = config
+        self._templates: dict[str, CardBuilder.CardTemplate] = {}
 
     def build(self, card_info: dict[str, str]) -> Card:
-        card = Card(self._w, self._h)
         card_type = card_info.get("card_type") or self._default_type
-        layers = h.require(self._specs, card_type)
-        card.add_layers(
-            CardLayerFactory.build(
-                layers, self._config, card_info, self._input_provider
-            )
-        )
+        template = self._get_template(card_type)
+        card = Card(self._w, self._h, template.plate)
+        for run in template.runs:
+            if isinstance(run, CardLayer):
+                card.add_layer(run)
+            else:
+                card.add_layers(
+                    CardLayerFactory.build(
+                        run, self._config, card_info, self._input_provider
+                    )
+                )
         return card
 
+    # digest of everything the card built from the decklist row looks like:
+    # its layer specs, the row, and the contents of its images and fonts
+    def get_digest(self, card_info: dict[str, str], card: Card) -> str:
+        card_type = card_info.get("card_type") or self._default_type
+        template = self._get_template(card_type)
+        image_names = card.get_image_names()
+        font_files = card.get_font_files()
+        for layer in template.plate_layers:
+            image_names.extend(layer.get_image_names())
+            font_files.extend(layer.get_font_files())
+
+        digest_parts = [
+            h.require(self._specs, card_type),
+            self._w,
+            self._h,
+            self._config.get("text"),
+            self._config.get("symbols"),
+            {k: v for (k, v) in card_info.items() if k not in _NON_RENDERED_PROPS},
+            [
+                [name, self._input_provider.get_image_digest(name)]
+                for name in sorted(set(image_names))
+            ],
+            [[f, FontCache.get_digest(f)] for f in sorted(set(font_files))],
+        ]
+        return hashlib.sha1(
+            json.dumps(digest_parts, sort_keys=True).encode()
+        ).hexdigest()
+
     def build_back(self) -> Card:
         card = Card(self._w, self._h)
         card.add_layers(
@@ -45,3 +102,52 @@ class CardBuilder:
             ]
         )
         return card
+
+    def _get_template(self, card_type: str) -> CardTemplate:
+        template = self._templates.get(card_type)
+        if template is None:
+            template = self._build_template(h.require(self._specs, card_type))
+            self._templates[card_type] = template
+        return template
+
+    # splits the layers into contiguous runs of static and dynamic layers
+    def _build_template(self, layer_configs: list[dict]) -> CardTemplate:
+        runs: list[list[dict]] = []
+        for layer_config in layer_configs:
+            is_static = _is_static(layer_config)
+            if len(runs) == 0 or _is_static(runs[-1][0]) != is_static:
+                runs.append([])
+            runs[-1].append(layer_config)
+
+        plate = None
+        plate_layers = []
+        if len(runs) > 0 and _is_static(runs[0][0]):
+            plate = PIL.Image.new("RGBA", (int(self._w), int(self._h)))
+            plate_layers = self._build_static_layers(runs.pop(0))
+            for layer in plate_layers:
+                layer.render(plate)
+
+        template = CardBuilder.CardTemplate(plate, plate_layers, [])
+        for run in runs:
+            # flattening a lone image gains nothing over pasting it
+            if _is_static(run[0]) and not (
+                len(run) == 1 and run[0].get("type") == CardLayerType.STATIC_IMAGE
+            ):
+                template.runs.append(self._flatten(run))
+            else:
+                template.runs.append(run)
+        return template
+
+    def _flatten(self, layer_configs: list[dict]) -> CardLayer:
+        return FlattenedCardLayer(
+            self._build_static_layers(layer_configs), int(self._w), int(self._h)
+        )
+
+    def _build_static_layers(self, layer_configs: list[dict]) -> list[CardLayer]:
+        return CardLayerFactory.build(
+            layer_configs, self._config, {}, self._input_provider
+        )
+
+
+def _is_static(layer_config: dict) -> bool:
+    return layer_config.get("type") in _STATIC_LAYER_TYPES
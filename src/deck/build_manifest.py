@@ -0,0 +1,81 @@
+#!/usr/bin/python
+import json
+import os
+from typing import Optional
+
+from util.helpers import Helpers as h
+
+
+# records which tile is in each slot of the sheets saved to a folder, so the
+# next build only re-renders the slots whose cards changed. a sheet is only
+# trusted while its file is the one the manifest was saved with.
+class BuildManifest:
+    _VERSION = 1
+
+    def __init__(self, folder: str, deck_name: str):
+        self._folder = folder
+        self._file = os.path.join(folder, deck_name + "_manifest.json")
+        self._previous: dict[str, dict] = {}
+        self._sheets: dict[str, dict] = {}
+
+        if not os.path.exists(self._file):
+            return
+        try:
+            with open(self._file, "r") as f:
+                stored = json.load(f)
+            if stored.get("version") == BuildManifest._VERSION:
+                self._previous = stored["sheets"]
+        except (OSError, ValueError, KeyError) as e:
+            print("Warning: ignoring build manifest '" + self._file + "': " + str(e))
+
+    # returns the tile digests of the previously saved sheet, or None if the
+    # sheet's file changed, it had a different size or it held a different
+    # number of cards
+    def get_sheet(
+        self,
+        image_name: str,
+        tile_size: tuple[int, int],
+        width: int,
+        height: int,
+        num_cards: int,
+    ) -> Optional[list[str]]:
+        previous = self._previous.get(image_name)
+        file_state = h.get_file_state(self.get_sheet_file(image_name))
+        if (
+            previous is None
+            or file_state is None
+            or previous["file"] != file_state
+            or previous["tile_size"] != list(tile_size)
+            or previous["width"] != width
+            or previous["height"] != height
+            or len(previous["tiles"]) != num_cards
+        ):
+            return None
+        return previous["tiles"]
+
+    def get_sheet_file(self, image_name: str) -> str:
+        return os.path.join(self._folder, image_name)
+
+    def set_sheet(
+        self,
+        image_name: str,
+        tile_size: tuple[int, int],
+        width: int,
+        height: int,
+        tiles: list[str],
+    ):
+        self._sheets[image_name] = {
+            "tile_size": list(tile_size),
+            "width": width,
+            "height": height,
+            "tiles": tiles,
+        }
+
+    # call once the sheets are saved
+    def save(self):
+        for image_name, sheet in self._sheets.items():
+            sheet["file"] = h.get_file_state(self.get_sheet_file(image_name))
+        temp_file = self._file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"version": BuildManifest._VERSION, "sheets": self._sheets}, f)
+        os.replace(temp_file, self._file)
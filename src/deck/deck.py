@@ -1,22 +1,55 @@
 #!/usr/bin/python
 import contextlib
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from math import ceil
-from typing import Tuple
+from typing import Callable, Iterator, Optional, Tuple
 
 from PIL import Image as PILImage
 from PIL.Image import Image
 
 from card.card import Card
+from card.card_builder import CardBuilder
+from deck.build_manifest import BuildManifest
+from deck.shared_sheet import SharedSheet
+from deck.tile_store import TileStore
 from param.config_enums import ImageLayout
+from util.banded_image import BandedImage
 from util.helpers import Helpers as h
+from util.image_encoder import ImageEncoder
+from util.lru_cache import CacheStats
 
 
 class Deck:
     DEFAULT_MAX_WIDTH = 10
+    TILES_FOLDER = "tiles"
+
+    # a card, the decklist row it was built from and the number of copies of
+    # it in the deck. the digest identifies the rendered tile, if known.
+    @dataclass
+    class Entry:
+        card: Card
+        card_info: dict[str, str]
+        count: int
+        digest: Optional[str] = None
+
+    # a sheet of cards, from the deck's card at index start
+    @dataclass
+    class Sheet:
+        start: int
+        size: int
+        # in cards
+        width: int
+        height: int
 
     def __init__(self, name: str, config: dict):
         self._name = name
-        self._cards: list[Card] = list()
+        self._config = config
+        self._entries: list[Deck.Entry] = list()
         self._back = None
         self._layout = (
             h.dont_require(config, "output/image_layout") or ImageLayout.SHEET
@@ -29,20 +62,99 @@ class Deck:
         self._sheet_max_width = (
             h.dont_require(config, "output/sheet_max_width") or Deck.DEFAULT_MAX_WIDTH
         )
+        # optional limits, in cards and in pixels per side
+        self._sheet_max_height = h.dont_require(config, "output/sheet_max_height")
+        self._sheet_max_pixels = h.dont_require(config, "output/sheet_max_pixels")
+        self._render_workers = int(h.dont_require(config, "output/render_workers") or 1)
+        self._encoder = ImageEncoder.build(config)
+        self._incremental = bool(h.dont_require(config, "cache/incremental"))
+        self._tile_cache_max_bytes = h.dont_require(config, "cache/max_bytes")
+        # rendered cards shared by every deck built with the same cache/dir
+        cache_dir = h.dont_require(config, "cache/dir")
+        self._tile_store: Optional[TileStore] = (
+            TileStore(cache_dir, self._tile_cache_max_bytes)
+            if cache_dir is not None
+            else None
+        )
+        self._manifest: Optional[BuildManifest] = None
+        # render workers, started when first needed by a render
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._rendered_count = 0
+        self._reused_count = 0
 
     def get_size(self):
-        return len(self._cards)
+        return sum(entry.count for entry in self._entries)
 
     def get_name(self):
         return self._name
 
-    def get_dimensions(self) -> Tuple[int, int]:
-        width = min(self._sheet_max_width, self.get_size())
-        height = ceil(self.get_size() / width)
-        return (width, height)
+    def get_image_name(self, index: int) -> str:
+        return self._name + "_" + str(index) + "." + self._encoder.get_extension()
+
+    def get_back_image_name(self) -> str:
+        return self._name + "_back." + self._encoder.get_extension()
+
+    # whether cards unchanged since the previous build are reused
+    def is_incremental(self) -> bool:
+        return self._incremental
+
+    # whether rendered cards are reused, which needs the digest of each card
+    def needs_digests(self) -> bool:
+        return self._incremental or self._tile_store is not None
+
+    # reuses the sheets of the previous build saved to the folder, and its
+    # tiles unless a cache/dir is shared
+    def open_build_folder(self, folder: str):
+        if self._tile_store is None:
+            self._tile_store = TileStore(
+                os.path.join(folder, Deck.TILES_FOLDER), self._tile_cache_max_bytes
+            )
+        self._manifest = BuildManifest(folder, self._name)
+
+    # records the rendered sheets; call once they are saved
+    def save_manifest(self):
+        if self._manifest is not None:
+            self._manifest.save()
+
+    def get_tile_store_stats(self) -> Optional[CacheStats]:
+        return self._tile_store.stats() if self._tile_store is not None else None
+
+    # numbers of distinct cards rendered and reused by the last render
+    def get_render_counts(self) -> Tuple[int, int]:
+        return (self._rendered_count, self._reused_count)
 
-    def add_card(self, card: Card):
-        self._cards.append(card)
+    # splits the cards into sheets within the configured limits; without
+    # limits on height or pixels, all cards go on one sheet
+    def get_sheets(self) -> list[Sheet]:
+        num_cards = self.get_size()
+        max_w = self._sheet_max_width
+        max_h = self._sheet_max_height
+        if self._sheet_max_pixels is not None:
+            (tile_w, tile_h) = self._get_tile_size()
+            max_w = min(max_w, max(1, self._sheet_max_pixels // tile_w))
+            max_h = min(max_h or num_cards, max(1, self._sheet_max_pixels // tile_h))
+        per_sheet = max_w * max_h if max_h is not None else num_cards
+
+        sheets = []
+        start = 0
+        while start < num_cards:
+            size = min(per_sheet, num_cards - start)
+            width = min(max_w, size)
+            sheets.append(Deck.Sheet(start, size, width, ceil(size / width)))
+            start = start + size
+        return sheets
+
+    # copies are rendered once and placed in consecutive slots. the digest is
+    # CardBuilder.get_digest of the card.
+    def add_card(
+        self,
+        card: Card,
+        card_info: dict[str, str],
+        count: int = 1,
+        digest: Optional[str] = None,
+    ):
+        tile_digest = self._get_tile_digest(digest) if digest is not None else None
+        self._entries.append(Deck.Entry(card, card_info, count, tile_digest))
 
     def set_back(self, back: Card):
         self._back = back
@@ -50,8 +162,17 @@ class Deck:
     def has_back(self) -> bool:
         return not not self._back
 
-    def render(self) -> list[Image]:
-        return (
+    # yields each sheet or singleton image as soon as it is rendered. the
+    # caller owns each image and must close it, and may keep it past the
+    # iteration without copying it. copies of a card in singleton layout
+    # share their pixels, which must not be modified. new sheets are banded
+    # images whose rows of cards render as their bands are read, possibly on
+    # another thread; the next image is only yielded once they are all read
+    # or the sheet is closed.
+    def render(self) -> Iterator[Image | BandedImage]:
+        self._rendered_count = 0
+        self._reused_count = 0
+        return self._shut_down_pool_after(
             self._render_singletons()
             if self._layout == ImageLayout.SINGLETON
             else self._render_sheets()
@@ -60,30 +181,62 @@ class Deck:
     def render_back(self) -> Image:
         return self._back.render()
 
-    def _render_sheets(self) -> list[Image]:
-        num_cards = len(self._cards)
-        if num_cards == 0:
-            return []
+    # sheets are rendered one after the other; a card with copies on two
+    # sheets is rendered for each. a sheet saved by the previous build is
+    # yielded whole, with only its changed cards pasted over it.
+    def _render_sheets(self) -> Iterator[Image | BandedImage]:
+        tile_size = self._get_tile_size()
+        for i, sheet in enumerate(self.get_sheets()):
+            image_name = self.get_image_name(i)
+            sheet_entries = self._get_sheet_entries(sheet)
+            tiles = [None] * sheet.size
+            for entry, slots in sheet_entries:
+                for slot in slots:
+                    tiles[slot] = entry.digest
 
-        (num_w, num_h) = self.get_dimensions()
-        card_index = 0
-        deck_image = None
-        for y in range(num_h):
-            for x in range(num_w):
-                if card_index == len(self._cards):
-                    break
-
-                card = self._cards[card_index]
-                card_index = card_index + 1
-
-                with contextlib.closing(self._render_card(card)) as card_image:
-                    if deck_image is None:
-                        x_step = card_image.width
-                        y_step = card_image.height
-                        deck_pix_w = card_image.width * num_w
-                        deck_pix_h = card_image.height * num_h
-                        deck_image = PILImage.new("RGBA", (deck_pix_w, deck_pix_h))
+            previous = self._open_previous_sheet(image_name, sheet)
+            if previous is not None:
+                (previous_image, previous_tiles) = previous
+                changed_entries = []
+                for entry, slots in sheet_entries:
+                    changed = [s for s in slots if previous_tiles[s] != entry.digest]
+                    if len(changed) > 0:
+                        changed_entries.append((entry, changed))
+                    else:
+                        self._reused_count = self._reused_count + 1
+                yield self._paste_entries(sheet, changed_entries, previous_image)
+            else:
+                image = BandedImage(
+                    "RGBA",
+                    (tile_size[0] * sheet.width, tile_size[1] * sheet.height),
+                    self._render_shared_sheet_bands(sheet, sheet_entries)
+                    if self._render_workers > 1
+                    else self._render_sheet_bands(sheet, sheet_entries),
+                )
+                yield image
+                image.wait()
+
+            # sheets saved lossy can't be reused, since their pixels changed
+            if self._manifest is not None and self._encoder.is_lossless():
+                self._manifest.set_sheet(
+                    image_name, tile_size, sheet.width, sheet.height, tiles
+                )
 
+    # pastes the entries into their slots of deck_image
+    def _paste_entries(
+        self,
+        sheet: Sheet,
+        sheet_entries: list[tuple[Entry, list[int]]],
+        deck_image: Image,
+    ) -> Image:
+        (x_step, y_step) = self._get_tile_size()
+        for (_, slots), (_, rendered) in zip(
+            sheet_entries,
+            self._render_entries([entry for (entry, _) in sheet_entries]),
+        ):
+            with contextlib.closing(rendered) as card_image:
+                for slot in slots:
+                    (x, y) = (slot % sheet.width, slot // sheet.width)
                     deck_image.paste(
                         im=card_image,
                         box=(
@@ -93,18 +246,281 @@ class Deck:
                             (y + 1) * y_step,
                         ),
                     )
+        return deck_image
+
+    # renders the sheet one row of cards at a time, each band closed when
+    # the next is requested. a card is rendered once for all its copies,
+    # which may run over several rows.
+    def _render_sheet_bands(
+        self, sheet: Sheet, sheet_entries: list[tuple[Entry, list[int]]]
+    ) -> Iterator[Image]:
+        (tile_w, tile_h) = self._get_tile_size()
+        rendered = self._render_entries([entry for (entry, _) in sheet_entries])
+        starting = deque(sheet_entries)
+        placing: list[tuple[Image, list[int]]] = []
+        try:
+            for row in range(sheet.height):
+                row_end = (row + 1) * sheet.width
+                while len(starting) > 0 and starting[0][1][0] < row_end:
+                    (_, slots) = starting.popleft()
+                    (_, tile) = next(rendered)
+                    placing.append((tile, slots))
+
+                band = PILImage.new("RGBA", (tile_w * sheet.width, tile_h))
+                placing = self._place_row(
+                    placing,
+                    row_end,
+                    lambda tile, slot: band.paste(
+                        im=tile, box=((slot % sheet.width) * tile_w, 0)
+                    ),
+                )
+                with contextlib.closing(band):
+                    yield band
+        finally:
+            for tile, _ in placing:
+                tile.close()
+            rendered.close()
 
-        return [deck_image]
+    # like _render_sheet_bands, but workers write their cards straight into
+    # the band's shared memory, at the same offsets the serial render pastes
+    # them. stored tiles, and copies in later rows, are written by this
+    # process, which also stores the new tiles.
+    def _render_shared_sheet_bands(
+        self, sheet: Sheet, sheet_entries: list[tuple[Entry, list[int]]]
+    ) -> Iterator[Image]:
+        (tile_w, tile_h) = self._get_tile_size()
+
+        def _get_offset(slot: int) -> tuple[int, int]:
+            return ((slot % sheet.width) * tile_w, 0)
+
+        starting = deque(sheet_entries)
+        placing: list[tuple[Image, list[int]]] = []
+        try:
+            for row in range(sheet.height):
+                row_end = (row + 1) * sheet.width
+                band_sheet = SharedSheet.create((tile_w * sheet.width, tile_h))
+                band = band_sheet.to_image()
+                try:
+                    new_entries = []
+                    while len(starting) > 0 and starting[0][1][0] < row_end:
+                        (entry, slots) = starting.popleft()
+                        stored = self._get_stored_tile(entry)
+                        if stored is None:
+                            new_entries.append((entry, slots))
+                        else:
+                            placing.append((stored, slots))
+                    placing = self._place_row(
+                        placing,
+                        row_end,
+                        lambda tile, slot: band_sheet.write(tile, _get_offset(slot)),
+                    )
 
-    def _render_singletons(self) -> list[Image]:
-        num_cards = len(self._cards)
-        if num_cards == 0:
-            return []
-        result = []
-        for card_index in range(num_cards):
-            card = self._cards[card_index]
-            result.append(self._render_card(card))
-        return result
+                    # consume the results to surface worker errors
+                    for _ in self._map_in_order(
+                        self._get_pool(),
+                        _render_in_worker_into_sheet,
+                        [entry.card_info for (entry, _) in new_entries],
+                        [
+                            [_get_offset(slot) for slot in slots if slot < row_end]
+                            for (_, slots) in new_entries
+                        ],
+                        [band_sheet.get_name()] * len(new_entries),
+                        [band_sheet.get_size()] * len(new_entries),
+                    ):
+                        pass
+                    self._rendered_count = self._rendered_count + len(new_entries)
+
+                    for entry, slots in new_entries:
+                        (x, y) = _get_offset(slots[0])
+                        tile = band.crop((x, y, x + tile_w, y + tile_h))
+                        self._store_tile(entry, tile)
+                        later = [slot for slot in slots if slot >= row_end]
+                        if len(later) > 0:
+                            placing.append((tile, later))
+                        else:
+                            tile.close()
+                except BaseException:
+                    band.close()
+                    raise
+                finally:
+                    # only the workers needed the name; the memory stays mapped
+                    band_sheet.unlink()
+                with contextlib.closing(band):
+                    yield band
+        finally:
+            for tile, _ in placing:
+                tile.close()
+
+    # places the copies of the cards in the row ending before slot row_end,
+    # and returns the cards with copies in later rows, closing the others
+    def _place_row(
+        self,
+        placing: list[tuple[Image, list[int]]],
+        row_end: int,
+        place: Callable[[Image, int], None],
+    ) -> list[tuple[Image, list[int]]]:
+        later_rows = []
+        for tile, slots in placing:
+            for slot in slots:
+                if slot < row_end:
+                    place(tile, slot)
+            later = [slot for slot in slots if slot >= row_end]
+            if len(later) > 0:
+                later_rows.append((tile, later))
+            else:
+                tile.close()
+        return later_rows
+
+    # returns the previous build's sheet and the digests of its tiles, if it
+    # has the same layout
+    def _open_previous_sheet(
+        self, image_name: str, sheet: Sheet
+    ) -> Optional[tuple[Image, list[Optional[str]]]]:
+        if self._manifest is None:
+            return None
+        tile_size = self._get_tile_size()
+        previous_tiles = self._manifest.get_sheet(
+            image_name, tile_size, sheet.width, sheet.height, sheet.size
+        )
+        if previous_tiles is None:
+            return None
+
+        try:
+            with PILImage.open(self._manifest.get_sheet_file(image_name)) as opened:
+                opened.load()
+                image = opened._new(opened.im)
+        except (OSError, ValueError) as e:
+            print("Warning: rebuilding sheet '" + image_name + "': " + str(e))
+            return None
+        if image.mode not in ["RGB", "RGBA"] or image.size != (
+            tile_size[0] * sheet.width,
+            tile_size[1] * sheet.height,
+        ):
+            image.close()
+            return None
+        if image.mode == "RGB":
+            # saved without its alpha because it was fully opaque
+            with contextlib.closing(image):
+                image = image.convert("RGBA")
+        return (image, previous_tiles)
+
+    # the entries with copies on the sheet, and the sheet slots of the copies
+    def _get_sheet_entries(self, sheet: Sheet) -> list[tuple[Entry, list[int]]]:
+        sheet_entries = []
+        card_index = 0
+        for entry in self._entries:
+            slots = [
+                i - sheet.start
+                for i in range(card_index, card_index + entry.count)
+                if sheet.start <= i < sheet.start + sheet.size
+            ]
+            if len(slots) > 0:
+                sheet_entries.append((entry, slots))
+            card_index = card_index + entry.count
+        return sheet_entries
+
+    def _render_singletons(self) -> Iterator[Image]:
+        for entry, rendered in self._render_entries(self._entries):
+            with contextlib.closing(rendered) as card_image:
+                for _ in range(entry.count):
+                    yield card_image._new(card_image.im)
+
+    # renders each entry in deck order, in worker processes if configured.
+    # workers build their cards from the decklist rows, and the rendered
+    # images are identical either way. stored tiles are reused.
+    def _render_entries(self, entries: list[Entry]) -> Iterator[tuple[Entry, Image]]:
+        new_entries = [entry for entry in entries if not self._has_stored_tile(entry)]
+        new_ids = {id(entry) for entry in new_entries}
+        rendered = self._render_new_entries(new_entries)
+        for entry in entries:
+            is_new = id(entry) in new_ids
+            stored = self._get_stored_tile(entry) if not is_new else None
+            if stored is not None:
+                yield (entry, stored)
+                continue
+            if is_new:
+                (_, tile) = next(rendered)
+            else:
+                # the stored tile could not be read
+                tile = self._render_card(entry.card)
+                self._rendered_count = self._rendered_count + 1
+            self._store_tile(entry, tile)
+            yield (entry, tile)
+        rendered.close()
+
+    def _render_new_entries(
+        self, entries: list[Entry]
+    ) -> Iterator[tuple[Entry, Image]]:
+        self._rendered_count = self._rendered_count + len(entries)
+        if self._render_workers <= 1:
+            for entry in entries:
+                yield (entry, self._render_card(entry.card))
+            return
+
+        tiles = self._map_in_order(
+            self._get_pool(), _render_in_worker, [entry.card_info for entry in entries]
+        )
+        for entry, (mode, size, data) in zip(entries, tiles):
+            yield (entry, PILImage.frombytes(mode, size, data))
+
+    def _has_stored_tile(self, entry: Entry) -> bool:
+        return (
+            self._tile_store is not None
+            and entry.digest is not None
+            and self._tile_store.contains(entry.digest)
+        )
+
+    def _get_stored_tile(self, entry: Entry) -> Optional[Image]:
+        if self._tile_store is None or entry.digest is None:
+            return None
+        tile = self._tile_store.get(entry.digest)
+        if tile is not None:
+            self._reused_count = self._reused_count + 1
+        return tile
+
+    def _store_tile(self, entry: Entry, tile: Image):
+        if self._tile_store is not None and entry.digest is not None:
+            self._tile_store.put(entry.digest, tile)
+
+    # the tile also depends on how the deck scales and pads cards
+    def _get_tile_digest(self, card_digest: str) -> str:
+        return hashlib.sha1(
+            json.dumps(
+                [card_digest, self._scaling, self._padding, self._padding_color]
+            ).encode()
+        ).hexdigest()
+
+    # the workers build their card builder once, so every sheet and singleton
+    # of a render shares them
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._render_workers,
+                initializer=_init_render_worker,
+                initargs=(self._name, self._config),
+            )
+        return self._pool
+
+    # shuts down the workers, if any, once the images are rendered or the
+    # iteration is closed
+    def _shut_down_pool_after(self, images: Iterator[Image]) -> Iterator[Image]:
+        try:
+            yield from images
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    # like pool.map, but only submits a few tasks per worker ahead of the
+    # results consumed, so rendered cards don't pile up in memory
+    def _map_in_order(self, pool: ProcessPoolExecutor, fn, *iterables) -> Iterator:
+        pending = deque()
+        for args in zip(*iterables):
+            pending.append(pool.submit(fn, *args))
+            if len(pending) >= 2 * self._render_workers:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
 
     def _render_card(self, card: Card) -> Image:
         image = card.render()
@@ -113,6 +529,18 @@ class Deck:
 
         return image
 
+    # size of a rendered card after scaling and padding
+    def _get_tile_size(self) -> Tuple[int, int]:
+        tile_w = int(h.require(self._config, "w"))
+        tile_h = int(h.require(self._config, "h"))
+        if self._scaling is not None:
+            tile_w = int(tile_w * self._scaling[0])
+            tile_h = int(tile_h * self._scaling[1])
+        if self._padding is not None:
+            tile_w = int(tile_w + 2 * self._padding[0])
+            tile_h = int(tile_h + 2 * self._padding[1])
+        return (tile_w, tile_h)
+
     def _then_close(self, fn, closable):
         with contextlib.closing(closable):
             return fn(closable)
@@ -142,3 +570,44 @@ class Deck:
                 int(card_image.height * self._scaling[1]),
             )
         )
+
+
+# per process state of render workers
+_worker_card_builder: Optional[CardBuilder] = None
+_worker_deck: Optional[Deck] = None
+_worker_sheets: dict[str, SharedSheet] = {}
+
+
+def _init_render_worker(name: str, config: dict):
+    global _worker_card_builder, _worker_deck
+    _worker_card_builder = CardBuilder(config)
+    _worker_deck = Deck(name, config)
+
+
+# returns the rendered, scaled and padded card as (mode, size, bytes)
+def _render_in_worker(card_info: dict[str, str]) -> tuple[str, tuple[int, int], bytes]:
+    card = _worker_card_builder.build(card_info)
+    with contextlib.closing(_worker_deck._render_card(card)) as image:
+        return (image.mode, image.size, image.tobytes())
+
+
+# renders the card into each of its slots (top left offsets) of a shared sheet
+def _render_in_worker_into_sheet(
+    card_info: dict[str, str],
+    slots: list[tuple[int, int]],
+    sheet_name: str,
+    sheet_size: tuple[int, int],
+):
+    sheet = _worker_sheets.get(sheet_name)
+    if sheet is None:
+        # the workers outlive each sheet, so let go of the previous ones
+        for previous in _worker_sheets.values():
+            previous.close()
+        _worker_sheets.clear()
+        sheet = SharedSheet.attach(sheet_name, sheet_size)
+        _worker_sheets[sheet_name] = sheet
+
+    card = _worker_card_builder.build(card_info)
+    with contextlib.closing(_worker_deck._render_card(card)) as image:
+        for slot in slots:
+            sheet.write(image, slot)
@@ -12,8 +12,14 @@ class DeckBuilder:
     def build(self, name: str, cards_config: list[dict]) -> Deck:
         deck = Deck(name, self._config)
         for card_config in cards_config:
-            if not bool(card_config.get("skip")):
-                for _ in range(int(card_config.get("count") or 1)):
-                    deck.add_card(self._cb.build(card_config))
+            count = int(card_config.get("count") or 1)
+            if not bool(card_config.get("skip")) and count > 0:
+                card = self._cb.build(card_config)
+                digest = (
+                    self._cb.get_digest(card_config, card)
+                    if deck.needs_digests()
+                    else None
+                )
+                deck.add_card(card, card_config, count, digest)
         deck.set_back(self._cb.build_back())
         return deck
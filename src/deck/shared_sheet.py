@@ -0,0 +1,86 @@
+#!/usr/bin/python
+from multiprocessing import shared_memory
+
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+_MODE = "RGBA"
+_PIXEL_BYTES = 4
+
+
+# an RGBA sheet whose pixels live in shared memory, so render workers can
+# write their cards into it directly instead of sending the images back
+class SharedSheet:
+    def __init__(self, memory: shared_memory.SharedMemory, size: tuple[int, int]):
+        self._memory = memory
+        self._size = size
+
+    # new shared memory is zeroed, like a new transparent RGBA image
+    @staticmethod
+    def create(size: tuple[int, int]) -> "SharedSheet":
+        memory = shared_memory.SharedMemory(
+            create=True, size=max(1, size[0] * size[1] * _PIXEL_BYTES)
+        )
+        return SharedSheet(memory, size)
+
+    @staticmethod
+    def attach(name: str, size: tuple[int, int]) -> "SharedSheet":
+        return SharedSheet(shared_memory.SharedMemory(name=name), size)
+
+    def get_name(self) -> str:
+        return self._memory.name
+
+    def get_size(self) -> tuple[int, int]:
+        return self._size
+
+    # same as pasting the image into the sheet with its top left at xy
+    def write(self, image: Image, xy: tuple[int, int]):
+        if image.mode != _MODE:
+            raise Exception("Expected " + _MODE + " image, got " + image.mode)
+        (x, y) = xy
+        (w, h) = image.size
+        if x < 0 or y < 0 or x + w > self._size[0] or y + h > self._size[1]:
+            raise Exception("Image does not fit in the sheet at " + str(xy))
+
+        data = image.tobytes()
+        row_bytes = w * _PIXEL_BYTES
+        sheet_row_bytes = self._size[0] * _PIXEL_BYTES
+        buf = self._memory.buf
+        for row in range(h):
+            start = (y + row) * sheet_row_bytes + x * _PIXEL_BYTES
+            buf[start : start + row_bytes] = data[
+                row * row_bytes : (row + 1) * row_bytes
+            ]
+
+    # wraps the shared pixels without copying them. the image owns the sheet:
+    # closing it closes the sheet, which is not closed otherwise
+    def to_image(self) -> Image:
+        return _SharedSheetImage(
+            self,
+            PILImage.frombuffer(
+                _MODE, self._size, self._memory.buf, "raw", _MODE, 0, 1
+            ),
+        )
+
+    def close(self):
+        self._memory.close()
+
+    def unlink(self):
+        self._memory.unlink()
+
+
+# an image of a shared sheet's pixels, which closes the sheet once it is
+# closed itself and no longer holds the pixels. images derived from it are
+# ordinary images.
+class _SharedSheetImage(Image):
+    def __init__(self, sheet: SharedSheet, wrapped: Image):
+        super().__init__()
+        self._sheet = sheet
+        self.im = wrapped.im
+        self._mode = wrapped.mode
+        self._size = wrapped.size
+        self.readonly = wrapped.readonly
+
+    def close(self):
+        super().close()
+        self._sheet.close()
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+import os
+import tempfile
+import threading
+from typing import Optional
+
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+from util.lru_cache import CacheStats
+
+
+# rendered cards (scaled and padded) stored as png files named by their
+# digest. several builds may share the folder: tiles are written atomically
+# and the least recently used ones are removed once the folder holds more
+# than max_bytes.
+class TileStore:
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+    # tiles are written often and read back once, so favour fast compression
+    _COMPRESS_LEVEL = 1
+    # eviction goes below the budget so it doesn't run on every put
+    _EVICT_TO_RATIO = 0.9
+
+    def __init__(self, folder: str, max_bytes: Optional[int] = None):
+        self._folder = os.path.abspath(folder)
+        if not os.path.exists(self._folder):
+            os.makedirs(self._folder)
+        self._max_bytes = (
+            TileStore.DEFAULT_MAX_BYTES if max_bytes is None else int(max_bytes)
+        )
+        self._lock = threading.Lock()
+        # the folder is scanned on the first put or stats
+        self._stats: Optional[CacheStats] = None
+        self._evictions = 0
+        self._hits = 0
+        self._misses = 0
+
+    # a missing tile counts as a miss, since it is not read after
+    def contains(self, digest: str) -> bool:
+        found = os.path.exists(self._get_file(digest))
+        if not found:
+            self._count(hit=False)
+        return found
+
+    def get(self, digest: str) -> Optional[Image]:
+        file = self._get_file(digest)
+        try:
+            with PILImage.open(file) as opened:
+                opened.load()
+                tile = opened._new(opened.im)
+            # the modification time orders tiles for eviction
+            os.utime(file)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return tile
+
+    # written to a temporary file first, so readers never see a partial tile
+    def put(self, digest: str, tile: Image):
+        file = self._get_file(digest)
+        is_new = not os.path.exists(file)
+        (fd, temp_file) = tempfile.mkstemp(suffix=".tmp", dir=self._folder)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                tile.save(f, format="png", compress_level=TileStore._COMPRESS_LEVEL)
+            os.replace(temp_file, file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+        if not is_new:
+            return
+
+        with self._lock:
+            if self._stats is None:
+                # counts the new tile too
+                self._scan()
+            else:
+                self._stats.entries = self._stats.entries + 1
+                self._stats.size_bytes = self._stats.size_bytes + os.path.getsize(file)
+            if self._stats.size_bytes > self._max_bytes:
+                self._evict()
+
+    # number of tiles and their total size, as of the last scan of the folder
+    # plus the tiles put since, and the tiles read or missed by this store
+    def stats(self) -> CacheStats:
+        with self._lock:
+            stats = CacheStats(**vars(self._get_stats()))
+            stats.hits = self._hits
+            stats.misses = self._misses
+            return stats
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self._hits = self._hits + 1
+            else:
+                self._misses = self._misses + 1
+
+    def _get_file(self, digest: str) -> str:
+        return os.path.join(self._folder, digest + ".png")
+
+    def _get_stats(self) -> CacheStats:
+        if self._stats is None:
+            self._scan()
+        return self._stats
+
+    # returns (modification time, size, file) of each tile
+    def _scan(self) -> list[tuple[float, int, str]]:
+        tiles = []
+        for entry in os.scandir(self._folder):
+            if not entry.name.endswith(".png"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # removed by another build
+                continue
+            tiles.append((stat.st_mtime, stat.st_size, entry.path))
+        self._stats = CacheStats(
+            evictions=self._evictions,
+            entries=len(tiles),
+            size_bytes=sum(size for (_, size, _) in tiles),
+        )
+        return tiles
+
+    # removes the least recently used tiles
+    def _evict(self):
+        target_bytes = self._max_bytes * TileStore._EVICT_TO_RATIO
+        for _, size, file in sorted(self._scan()):
+            if self._stats.size_bytes <= target_bytes:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            self._evictions = self._evictions + 1
+            self._stats.evictions = self._evictions
+            self._stats.entries = self._stats.entries - 1
+            self._stats.size_bytes = self._stats.size_bytes - size
@@ -1,54 +1,88 @@
 #!/usr/bin/python
 
 import contextlib
+import threading
 from abc import ABC
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
 
 from PIL.Image import Image
 
 from card.card_builder import CardBuilder
 from deck.deck import Deck
 from deck.deck_builder import DeckBuilder
+from layer.text_layout_cache import TextLayoutCache
 from param.input_parameters import InputParameters
 from provider.input_provider import InputProvider
 from provider.output_provider import OutputProvider
+from util.banded_image import BandedImage
+from util.helpers import Helpers as h
 
 
 class Generator(ABC):
+    SAVE_QUEUE_SIZE = 2
+    SAVE_WORKERS = 2
+
     @staticmethod
     def gen_deck(params: InputParameters, input_provider: InputProvider) -> Deck:
-        card_builder = CardBuilder(params.config)
+        layout_cache_file = h.dont_require(params.config, "cache/text_layout_file")
+        if layout_cache_file is not None:
+            TextLayoutCache.open(layout_cache_file)
+
+        card_builder = CardBuilder(params.config, input_provider)
         deck_builder = DeckBuilder(card_builder, params.config)
         decklist = input_provider.get_decklist(params.decklist)
         deck = deck_builder.build(params.deck_name, decklist)
         return deck
 
+    # renders the images while earlier ones are saved, and the back alongside
+    # the fronts. the rows of cards of a sheet render as its saver encodes
+    # them.
     @staticmethod
     def gen_and_save_images(
         deck: Deck,
         output_provider: OutputProvider,
-    ) -> list[str]:
-        def _save_and_close(img: Image, name: str) -> str:
+    ) -> tuple[list[str], Optional[str]]:
+        # rendering waits while this many images are waiting to be saved,
+        # which bounds the memory they hold
+        queued = threading.Semaphore(Generator.SAVE_QUEUE_SIZE)
+
+        def _save_and_close(img: Image | BandedImage, name: str) -> str:
             with contextlib.closing(img) as i:
                 return output_provider.save_image(i, name)
 
-        front_images = deck.render()
-        deck_name = deck.get_name()
-        front_files = list(
-            map(
-                _save_and_close,
-                front_images,
-                [
-                    Generator._get_image_name(deck_name, i)
-                    for i in range(len(front_images))
-                ],
+        def _save_queued(img: Image | BandedImage, name: str) -> str:
+            try:
+                return _save_and_close(img, name)
+            finally:
+                queued.release()
+
+        if deck.is_incremental():
+            deck.open_build_folder(output_provider.get_local_folder())
+        with ThreadPoolExecutor(max_workers=Generator.SAVE_WORKERS + 1) as pool:
+            back_future = (
+                pool.submit(
+                    lambda: _save_and_close(
+                        deck.render_back(), deck.get_back_image_name()
+                    )
+                )
+                if deck.has_back()
+                else None
             )
-        )
-        back_image = deck.render_back() if deck.has_back() else None
-        back_file = (
-            _save_and_close(back_image, deck_name + "_back.png") if back_image else None
-        )
+            front_futures: list[Future] = []
+            # each image is handed over to its saver, which closes it
+            for i, image in enumerate(deck.render()):
+                queued.acquire()
+                for future in front_futures:
+                    if future.done() and future.exception() is not None:
+                        queued.release()
+                        image.close()
+                        future.result()
+                front_futures.append(
+                    pool.submit(_save_queued, image, deck.get_image_name(i))
+                )
+            front_files = [future.result() for future in front_futures]
+            back_file = back_future.result() if back_future is not None else None
+        deck.save_manifest()
+        TextLayoutCache.save()
         return (front_files, back_file)
-
-    @staticmethod
-    def _get_image_name(deck_name: str, index: int) -> str:
-        return deck_name + "_" + str(index) + ".png"
@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+
+# runs file transfers on a bounded pool of threads, so requests to drive
+# overlap instead of waiting on each other's round trips. each file is
+# reported as it finishes and failures are collected rather than stopping
+# the other transfers.
+class DriveTransfers:
+    DEFAULT_CONCURRENCY = 8
+
+    # names of the files transferred, and of those that failed with the error
+    @dataclass
+    class Result:
+        completed: list[str]
+        failed: list[tuple[str, str]]
+
+    # action describes the finished transfers, e.g. "Downloaded"
+    def __init__(self, action: str, concurrency: int = DEFAULT_CONCURRENCY):
+        if concurrency < 1:
+            raise Exception(
+                "Transfer concurrency must be at least 1, got " + str(concurrency)
+            )
+        self._action = action
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="drive-transfer"
+        )
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._result = DriveTransfers.Result([], [])
+
+    def __enter__(self) -> "DriveTransfers":
+        return self
+
+    # waits for the submitted transfers, or cancels those not started if
+    # submitting failed
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+
+    def submit(self, name: str, transfer: Callable, *args):
+        with self._lock:
+            self._submitted = self._submitted + 1
+        future = self._executor.submit(transfer, *args)
+        future.add_done_callback(lambda f: self._on_done(name, f))
+
+    # fails a transferred file, e.g. when a later step for it failed
+    def fail(self, name: str, error: str):
+        with self._lock:
+            self._result.completed.remove(name)
+            self._result.failed.append((name, error))
+
+    # prints the number of files transferred and each failure, once the
+    # transfers are exited
+    def get_result(self) -> Result:
+        print(
+            "{} {} of {} files".format(
+                self._action, len(self._result.completed), self._submitted
+            )
+        )
+        for name, error in self._result.failed:
+            print("Warning: " + name + " failed: " + error)
+        return self._result
+
+    def _on_done(self, name: str, future: Future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        with self._lock:
+            if error is None:
+                self._result.completed.append(name)
+            else:
+                self._result.failed.append((name, str(error)))
+            done = len(self._result.completed) + len(self._result.failed)
+            if error is None:
+                print("[{}/{}] {}".format(done, self._submitted, name))
+            else:
+                print(
+                    "[{}/{}] Warning: {} failed: {}".format(
+                        done, self._submitted, name, error
+                    )
+                )
@@ -1,18 +1,27 @@
+import contextlib
 import csv
+import hashlib
 import io
 import os
 import pickle
 import re
+import threading
+import time
 import urllib
-from typing import Optional
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Optional
 
+import httplib2
 import requests
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaUpload
 
 from google.auth.transport.requests import Request
+from google.drive_transfers import DriveTransfers
 from google.oauth2.credentials import Credentials
+from google.streamed_upload import StreamedUpload
 
 
 class GoogleDriveClient:
@@ -20,10 +29,65 @@ class GoogleDriveClient:
         "https://www.googleapis.com/auth/drive.file",
     ]
     _TOKEN_FILE = "google_token.pickle"
+    _FILE_INFO_FIELDS = "id, md5Checksum, modifiedTime"
+    # folder listings older than this are listed again on the next lookup
+    FOLDER_INDEX_TTL_SECONDS = 300
+    # names looked up by a single files().list query
+    _NAMES_PER_QUERY = 50
+    # attempts of a streamed upload chunk after a transient failure, waiting
+    # twice as long before each
+    _UPLOAD_RETRIES = 5
+    _UPLOAD_RETRY_SECONDS = 0.5
+    # requests sent in a single batch, drive's limit
+    _BATCH_SIZE = 100
+    _SHARE_PERMISSION = {
+        "role": "writer",
+        "type": "anyone",
+    }
+
+    _build_count_lock = threading.Lock()
+    _build_count = 0
+
+    # a file found by name in a folder
+    @dataclass
+    class FileInfo:
+        id: str
+        md5_checksum: Optional[str]
+        modified_time: Optional[str]
+
+    # the files of a folder by name, as listed at listed_at
+    @dataclass
+    class FolderIndex:
+        listed_at: float
+        files: dict[str, list["GoogleDriveClient.FileInfo"]]
+
+    # files and bytes uploaded, and skipped because drive already had the
+    # same content
+    @dataclass
+    class UploadStats:
+        uploaded_files: int = 0
+        uploaded_bytes: int = 0
+        skipped_files: int = 0
+        skipped_bytes: int = 0
+
+        def __str__(self) -> str:
+            return "{} uploaded ({} bytes), {} unchanged and skipped ({} bytes)".format(
+                self.uploaded_files,
+                self.uploaded_bytes,
+                self.skipped_files,
+                self.skipped_bytes,
+            )
 
     def __init__(self, secrets_file: str):
         self._secrets_file = secrets_file
         self._cached_creds: Optional[Credentials] = None
+        self._creds_lock = threading.Lock()
+        # service objects and http sessions of each thread
+        self._local = threading.local()
+        self._index_lock = threading.Lock()
+        self._folder_indexes: dict[str, GoogleDriveClient.FolderIndex] = {}
+        self._stats_lock = threading.Lock()
+        self._upload_stats = GoogleDriveClient.UploadStats()
 
     def create_or_update_json(
         self, source: str, target_folder_id: str, name: str | None = None
@@ -41,15 +105,23 @@ class GoogleDriveClient:
         self, mime_type: str, source: str, target_folder_id: str, name: str | None
     ) -> str:
         target_name = os.path.split(source)[1] if name == None else name
-        existing = self.get_ids(target_name, target_folder_id)
-        existing_id = existing[0] if len(existing) > 0 else None
+        existing = self.get_file_info(target_name, target_folder_id)
 
-        if existing_id is not None:
-            self._update_file(mime_type, source, existing_id)
-            return existing_id
+        if existing is not None:
+            self._update_if_changed(mime_type, source, existing)
+            return existing.id
         else:
             return self._create_file(mime_type, source, target_folder_id, target_name)
 
+    # skips the upload when the checksum drive listed for the file matches
+    # the source's
+    def _update_if_changed(self, mime_type: str, source: str, existing: FileInfo):
+        md5_checksum = existing.md5_checksum
+        if md5_checksum is not None and md5_checksum == _get_file_md5(source):
+            self._record_skip(os.path.getsize(source))
+            return
+        self._update_file(mime_type, source, existing.id)
+
     def create_json(self, source: str, target_folder_id: str, name: str | None = None) -> str:
         return self._create_file("application/json", source, target_folder_id, name)
 
@@ -57,8 +129,7 @@ class GoogleDriveClient:
         return self._create_file("image/png", source, target_folder_id, name)
 
     def create_csv(self, name: str, target_folder_id: str) -> str:
-        creds = self._get_creds()
-        service = build("sheets", "v4", credentials=creds)
+        service = self._get_service("sheets", "v4")
         metadata = {
             "properties": {
                 "title": name,
@@ -71,7 +142,7 @@ class GoogleDriveClient:
         )
         id = spreadsheet.get("spreadsheetId")
 
-        driveService = build("drive", "v3", credentials=creds)
+        driveService = self._get_service("drive", "v3")
         file = driveService.files().get(fileId=id, fields="parents").execute()
         oldParents = ",".join(file.get("parents"))
         file = (
@@ -81,36 +152,40 @@ class GoogleDriveClient:
         )
         driveService.permissions().create(
             fileId=id,
-            body={
-                "role": "writer",
-                "type": "anyone",
-            },
+            body=GoogleDriveClient._SHARE_PERMISSION,
         ).execute()
         return id
 
+    # with share false the caller grants the permission, e.g. in a batch
     def _create_file(
-        self, mime_type: str, source: str, target_folder_id: str, name: str | None
+        self,
+        mime_type: str,
+        source: str,
+        target_folder_id: str,
+        name: str | None,
+        share: bool = True,
     ) -> str:
         target_name = os.path.split(source)[1] if name == None else name
-        creds = self._get_creds()
-        service = build("drive", "v3", credentials=creds)
         media = MediaFileUpload(source, mimetype=mime_type)
-        file = (
-            service.files()
-            .create(
-                body={"name": target_name, "parents": [target_folder_id]},
-                media_body=media,
-            )
-            .execute()
+        return self._create_media(media, target_folder_id, target_name, share)
+
+    def _create_media(
+        self, media: MediaUpload, target_folder_id: str, name: str, share: bool
+    ) -> str:
+        service = self._get_service("drive", "v3")
+        request = service.files().create(
+            body={"name": name, "parents": [target_folder_id]},
+            media_body=media,
+            fields=GoogleDriveClient._FILE_INFO_FIELDS,
         )
+        file = self._execute_upload(request, media)
+        self._add_to_index(target_folder_id, name, file)
+        self._record_upload(media.size())
 
-        service.permissions().create(
-            fileId=file.get("id"),
-            body={
-                "role": "writer",
-                "type": "anyone",
-            },
-        ).execute()
+        if share:
+            service.permissions().create(
+                fileId=file.get("id"), body=GoogleDriveClient._SHARE_PERMISSION
+            ).execute()
 
         return file.get("id")
 
@@ -121,17 +196,91 @@ class GoogleDriveClient:
         self._update_file("image/png", source, target_id)
 
     def _update_file(self, mime_type: str, source: str, target_id: str):
-        creds = self._get_creds()
-        service = build("drive", "v3", credentials=creds)
-        media = MediaFileUpload(source, mimetype=mime_type)
-        service.files().update(fileId=target_id, body={}, media_body=media).execute()
+        self._update_media(MediaFileUpload(source, mimetype=mime_type), target_id)
+
+    def _update_media(self, media: MediaUpload, target_id: str):
+        service = self._get_service("drive", "v3")
+        request = service.files().update(
+            fileId=target_id,
+            body={},
+            media_body=media,
+            fields=GoogleDriveClient._FILE_INFO_FIELDS,
+        )
+        file = self._execute_upload(request, media)
+        self._update_index(file)
+        self._record_upload(media.size())
+
+    # uploads the content written by write while it is being written, e.g.
+    # by an image encoder, unless drive already has the same content. write
+    # may run on another thread; with local_file the content is also saved
+    # there.
+    def create_or_update_streamed(
+        self,
+        mime_type: str,
+        write: Callable[[BinaryIO], None],
+        target_folder_id: str,
+        name: str,
+        local_file: Optional[str] = None,
+    ) -> str:
+        existing = self.get_file_info(name, target_folder_id)
+        with contextlib.closing(StreamedUpload(mime_type, write, local_file)) as media:
+            if existing is None:
+                return self._create_media(media, target_folder_id, name, True)
+
+            # only the whole content can be compared with drive's checksum,
+            # so replacing a file does not overlap writing and uploading
+            if media.get_md5() == existing.md5_checksum:
+                self._record_skip(media.size())
+            else:
+                self._update_media(media, existing.id)
+            return existing.id
+
+    # streamed uploads go chunk by chunk as the content is written, and
+    # after a transient failure continue from the last chunk drive
+    # acknowledged
+    def _execute_upload(self, request, media: MediaUpload) -> dict:
+        if not isinstance(media, StreamedUpload):
+            return request.execute()
+
+        retries = 0
+        file = None
+        while file is None:
+            media.wait_for_chunk(request.resumable_progress)
+            try:
+                (_, file) = request.next_chunk()
+                retries = 0
+            except (HttpError, httplib2.HttpLib2Error, OSError) as e:
+                if retries >= GoogleDriveClient._UPLOAD_RETRIES or (
+                    isinstance(e, HttpError)
+                    and e.resp.status < 500
+                    and e.resp.status != 429
+                ):
+                    raise
+                retries = retries + 1
+                time.sleep(GoogleDriveClient._UPLOAD_RETRY_SECONDS * 2**retries)
+        return file
+
+    def _record_upload(self, size: int):
+        with self._stats_lock:
+            stats = self._upload_stats
+            stats.uploaded_files = stats.uploaded_files + 1
+            stats.uploaded_bytes = stats.uploaded_bytes + size
+
+    def _record_skip(self, size: int):
+        with self._stats_lock:
+            stats = self._upload_stats
+            stats.skipped_files = stats.skipped_files + 1
+            stats.skipped_bytes = stats.skipped_bytes + size
+
+    def get_upload_stats(self) -> UploadStats:
+        with self._stats_lock:
+            return GoogleDriveClient.UploadStats(**vars(self._upload_stats))
 
     # downloads a file by Id, or if folder_id is given, by name
     def download_file(
         self, id_or_name: str, output_file_name: str, folder_id: Optional[str]
     ):
-        creds = self._get_creds()
-        service = build("drive", "v3", credentials=creds)
+        service = self._get_service("drive", "v3")
 
         lookup_id = id_or_name
         if folder_id is not None:
@@ -148,8 +297,7 @@ class GoogleDriveClient:
                 f.write(stream.getbuffer())
 
     def download_csv(self, id_or_name: str, folder_id: Optional[str]) -> csv.DictReader:
-        creds = self._get_creds()
-        service = build("sheets", "v4", credentials=creds)
+        service = self._get_service("sheets", "v4")
 
         lookup_id = id_or_name
         if folder_id is not None:
@@ -170,7 +318,7 @@ class GoogleDriveClient:
         url = result["spreadsheetUrl"]
         exportUrl = re.sub("\/edit$", "/export", url)
         headers = {
-            "Authorization": "Bearer " + creds.token,
+            "Authorization": "Bearer " + self._get_creds().token,
         }
 
         firstSheet = result["sheets"][0]
@@ -181,14 +329,13 @@ class GoogleDriveClient:
         queryParams = urllib.parse.urlencode(params)
         url = exportUrl + "?" + queryParams
 
-        response = requests.get(url, headers=headers)
+        response = self._get_session().get(url, headers=headers)
         contentString = response.content.decode(encoding=response.encoding)
         rows = contentString.split("\r\n")
         return csv.DictReader(rows, delimiter=",")
 
     def create_folder(self, name: str, parent_id: str) -> str:
-        creds = self._get_creds()
-        service = build("drive", "v3", credentials=creds)
+        service = self._get_service("drive", "v3")
         file = (
             service.files()
             .create(
@@ -203,77 +350,127 @@ class GoogleDriveClient:
         )
         service.permissions().create(
             fileId=file.get("id"),
-            body={
-                "role": "writer",
-                "type": "anyone",
-            },
+            body=GoogleDriveClient._SHARE_PERMISSION,
         ).execute()
         return file.get("id")
 
-    def download_folder(self, folder_id: str, output_folder: str):
-        creds = self._get_creds()
-        service = build("drive", "v3", credentials=creds)
+    # downloads the png, json and spreadsheet files in the folder. each page
+    # of the listing is downloaded while the next one is listed.
+    def download_folder(
+        self,
+        folder_id: str,
+        output_folder: str,
+        concurrency: int = DriveTransfers.DEFAULT_CONCURRENCY,
+    ) -> DriveTransfers.Result:
+        service = self._get_service("drive", "v3")
 
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
 
-        search_results: list[dict] = []
-        page_token = None
-        while True:
-            # pylint: disable=maybe-no-member
-            response = (
-                service.files()
-                .list(
-                    q=f"'{folder_id}' in parents and trashed=false",
-                    spaces="drive",
-                    fields="nextPageToken, files(id, name, mimeType)",
-                    pageToken=page_token,
+        with DriveTransfers("Downloaded", concurrency) as transfers:
+            page_token = None
+            while True:
+                # pylint: disable=maybe-no-member
+                response = (
+                    service.files()
+                    .list(
+                        q=f"'{folder_id}' in parents and trashed=false",
+                        spaces="drive",
+                        fields="nextPageToken, files(id, name, mimeType)",
+                        pageToken=page_token,
+                    )
+                    .execute()
                 )
-                .execute()
-            )
-
-            search_results.extend(response.get("files", []))
-            page_token = response.get("nextPageToken", None)
-            if page_token is None:
-                break
 
-        file_ids = map(
-            lambda f: (f.get("id") or "", f.get("name") or "", f.get("mimeType") or ""),
-            search_results,
+                for f in response.get("files", []):
+                    (id, name, mtype) = (
+                        f.get("id") or "",
+                        f.get("name") or "",
+                        f.get("mimeType") or "",
+                    )
+                    if (
+                        mtype == "image/png"
+                        or mtype == "application/json"
+                        or mtype == "application/vnd.google-apps.spreadsheet"
+                    ):
+                        transfers.submit(
+                            name,
+                            self._download_folder_file,
+                            id,
+                            name,
+                            mtype,
+                            output_folder,
+                        )
+                    else:
+                        print(
+                            "Warning: unsupported file '"
+                            + name
+                            + "' with mtype '"
+                            + mtype
+                            + "'"
+                        )
+                page_token = response.get("nextPageToken", None)
+                if page_token is None:
+                    break
+        return transfers.get_result()
+
+    def _download_folder_file(self, id: str, name: str, mtype: str, output_folder: str):
+        if mtype == "application/vnd.google-apps.spreadsheet":
+            out_name = os.path.join(output_folder, name.split(".")[0] + ".csv")
+            reader: csv.DictReader = self.download_csv(id, None)
+            with open(out_name, "w+") as out_file:
+                writer = csv.DictWriter(out_file, fieldnames=reader.fieldnames)
+                writer.writeheader()
+                for row in reader:
+                    writer.writerow(row)
+        else:
+            self.download_file(id, os.path.join(output_folder, name), None)
+
+    # uploads the png and json files in the folder, replacing the files with
+    # the same names in the target folder unless they are unchanged. the
+    # target is listed once up front rather than looked up for every file.
+    def upload_folder(
+        self,
+        source_folder: str,
+        target_folder_id: str,
+        concurrency: int = DriveTransfers.DEFAULT_CONCURRENCY,
+    ) -> DriveTransfers.Result:
+        mime_types = {".png": "image/png", ".json": "application/json"}
+        names = sorted(
+            f for f in os.listdir(source_folder) if os.path.splitext(f)[1] in mime_types
         )
-        for id, name, mtype in file_ids:
-            try:
-                if mtype == "image/png" or mtype == "application/json":
-                    out_name = os.path.join(output_folder, name)
-                    self.download_file(id, out_name, None)
-
-                elif mtype == "application/vnd.google-apps.spreadsheet":
-                    out_name = os.path.join(output_folder, name.split(".")[0] + ".csv")
-                    reader: csv.DictReader = self.download_csv(id, None)
-                    with open(out_name, "w+") as out_file:
-                        writer = csv.DictWriter(out_file, fieldnames=reader.fieldnames)
-                        writer.writeheader()
-                        for row in reader:
-                            writer.writerow(row)
-
-                else:
-                    print(
-                        "Warning: unsupported file '"
-                        + name
-                        + "' with mtype '"
-                        + mtype
-                        + "'"
+        existing = self.get_files(names, target_folder_id)
+        created_lock = threading.Lock()
+        created: dict[str, str] = {}
+
+        def create(mime_type: str, source: str, name: str):
+            id = self._create_file(mime_type, source, target_folder_id, name, False)
+            with created_lock:
+                created[id] = name
+
+        with DriveTransfers("Uploaded", concurrency) as transfers:
+            for name in names:
+                mime_type = mime_types[os.path.splitext(name)[1]]
+                source = os.path.join(source_folder, name)
+                if len(existing[name]) > 0:
+                    transfers.submit(
+                        name,
+                        self._update_if_changed,
+                        mime_type,
+                        source,
+                        existing[name][0],
                     )
-            except Exception as e:
-                print(
-                    "Warning: Failed to download " + name + ", id " + id + ": " + str(e)
-                )
+                else:
+                    transfers.submit(name, create, mime_type, source, name)
+
+        # the new files are shared together once uploaded
+        for id, error in self.share_files(list(created)).items():
+            transfers.fail(created[id], "sharing failed: " + error)
+        return transfers.get_result()
 
     def copy_file(
         self, id_or_name: str, source_folder: Optional[str], target_folder: str
     ) -> str:
-        creds = self._get_creds()
-
         source_id = id_or_name
         if source_folder is not None:
             ids = self.get_ids(id_or_name, source_folder)
@@ -282,29 +479,38 @@ class GoogleDriveClient:
 
         # clean up any copies in the target
         target_ids = self.get_ids(name, target_folder)
-        for target_id in target_ids:
-            self.delete_file(target_id)
+        failed = self.delete_files(target_ids)
+        if len(failed) > 0:
+            raise Exception("Failed to delete copies of " + name + ": " + str(failed))
 
-        service = build("drive", "v3", credentials=creds)
+        service = self._get_service("drive", "v3")
 
         copy = (
             service.files()
-            .copy(fileId=source_id, fields="id", body={"parents": [target_folder]})
+            .copy(
+                fileId=source_id,
+                fields=GoogleDriveClient._FILE_INFO_FIELDS,
+                body={"parents": [target_folder]},
+            )
             .execute()
         )
+        self._add_to_index(target_folder, name, copy)
         return copy.get("id")
 
     def get_name(self, id: str) -> str:
-        creds = self._get_creds()
-        service = build("drive", "v3", credentials=creds)
+        service = self._get_service("drive", "v3")
 
         response = service.files().get(fileId=id, fields="name").execute()
 
         return response.get("name")
 
+    # named lookups resolve from the folder index; without a name, every
+    # file in the folder is listed
     def get_ids(self, name: Optional[str], folder_id: str) -> list[str]:
-        creds = self._get_creds()
-        service = build("drive", "v3", credentials=creds)
+        if name is not None:
+            return [f.id for f in self.get_files([name], folder_id)[name]]
+
+        service = self._get_service("drive", "v3")
 
         files: list[dict] = []
         page_token = None
@@ -313,9 +519,7 @@ class GoogleDriveClient:
             response = (
                 service.files()
                 .list(
-                    q=f"name='{name}' and '{folder_id}' in parents and trashed=false"
-                    if name is not None
-                    else f"'{folder_id}' in parents",
+                    q=f"'{folder_id}' in parents",
                     spaces="drive",
                     fields="nextPageToken, files(id)",
                     pageToken=page_token,
@@ -329,19 +533,192 @@ class GoogleDriveClient:
                 break
         return list(map(lambda f: f.get("id"), files))
 
+    # returns the first file with the name in the folder, if any
+    def get_file_info(self, name: str, folder_id: str) -> Optional[FileInfo]:
+        files = self.get_files([name], folder_id)[name]
+        return files[0] if len(files) > 0 else None
+
+    # returns the files with each name in the folder. the folder is listed
+    # once into an index, again once the index is older than the TTL, and
+    # names missing from it are looked up together in case they were added
+    # since.
+    def get_files(self, names: list[str], folder_id: str) -> dict[str, list[FileInfo]]:
+        with self._index_lock:
+            index = self._folder_indexes.get(folder_id)
+        if (
+            index is None
+            or time.monotonic() - index.listed_at
+            > GoogleDriveClient.FOLDER_INDEX_TTL_SECONDS
+        ):
+            index = GoogleDriveClient.FolderIndex(
+                time.monotonic(), self._list_files(folder_id, None)
+            )
+            with self._index_lock:
+                self._folder_indexes[folder_id] = index
+        else:
+            missing = [n for n in set(names) if n not in index.files]
+            for i in range(0, len(missing), GoogleDriveClient._NAMES_PER_QUERY):
+                found = self._list_files(
+                    folder_id, missing[i : i + GoogleDriveClient._NAMES_PER_QUERY]
+                )
+                with self._index_lock:
+                    for name, files in found.items():
+                        index.files[name] = files
+
+        with self._index_lock:
+            return {name: list(index.files.get(name, [])) for name in names}
+
+    # lists the files in the folder, or only those with the given names
+    def _list_files(
+        self, folder_id: str, names: Optional[list[str]]
+    ) -> dict[str, list[FileInfo]]:
+        service = self._get_service("drive", "v3")
+
+        q = f"'{folder_id}' in parents and trashed=false"
+        if names is not None:
+            q = (
+                "("
+                + " or ".join("name='" + _escape_query(n) + "'" for n in names)
+                + ") and "
+                + q
+            )
+
+        files: dict[str, list[GoogleDriveClient.FileInfo]] = {}
+        page_token = None
+        while True:
+            # pylint: disable=maybe-no-member
+            response = (
+                service.files()
+                .list(
+                    q=q,
+                    spaces="drive",
+                    fields="nextPageToken, files(id, name, md5Checksum, modifiedTime)",
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+
+            for f in response.get("files", []):
+                files.setdefault(f.get("name"), []).append(_to_file_info(f))
+            page_token = response.get("nextPageToken", None)
+            if page_token is None:
+                break
+        return files
+
+    def _add_to_index(self, folder_id: str, name: str, file: dict):
+        with self._index_lock:
+            index = self._folder_indexes.get(folder_id)
+            if index is not None:
+                index.files.setdefault(name, []).append(_to_file_info(file))
+
+    def _update_index(self, file: dict):
+        with self._index_lock:
+            for index in self._folder_indexes.values():
+                for files in index.files.values():
+                    for i, f in enumerate(files):
+                        if f.id == file.get("id"):
+                            files[i] = _to_file_info(file)
+
+    def _remove_from_index(self, file_id: str):
+        with self._index_lock:
+            for index in self._folder_indexes.values():
+                for name, files in index.files.items():
+                    index.files[name] = [f for f in files if f.id != file_id]
+
     def delete_folder_contents(self, folder_id: str) -> int:
         ids = self.get_ids(None, folder_id)
         if len(ids) == 0:
             return 0
 
-        return len(list(map(self.delete_file, ids)))
+        failed = self.delete_files(ids)
+        for id, error in failed.items():
+            print("Warning: Failed to delete " + id + ": " + error)
+        return len(ids) - len(failed)
+
+    # deletes the files in batches, returning the error of each file that
+    # could not be deleted
+    def delete_files(self, file_ids: list[str]) -> dict[str, str]:
+        service = self._get_service("drive", "v3")
+        results = self._execute_batch(
+            service, {id: service.files().delete(fileId=id) for id in file_ids}
+        )
+        for id, result in results.items():
+            if not isinstance(result, Exception):
+                self._remove_from_index(id)
+        return _get_errors(results)
+
+    # lets anyone with the link edit the files, in batches, returning the
+    # error of each file that could not be shared
+    def share_files(self, file_ids: list[str]) -> dict[str, str]:
+        service = self._get_service("drive", "v3")
+        results = self._execute_batch(
+            service,
+            {
+                id: service.permissions().create(
+                    fileId=id, body=GoogleDriveClient._SHARE_PERMISSION
+                )
+                for id in file_ids
+            },
+        )
+        return _get_errors(results)
+
+    # sends the requests in batches, returning each response, or the error
+    # of the requests that failed on their own
+    def _execute_batch(self, service, requests: dict[str, object]) -> dict:
+        results = {}
+
+        def on_response(request_id: str, response, exception: Exception):
+            results[request_id] = response if exception is None else exception
+
+        keys = list(requests)
+        for i in range(0, len(keys), GoogleDriveClient._BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=on_response)
+            for key in keys[i : i + GoogleDriveClient._BATCH_SIZE]:
+                batch.add(requests[key], request_id=key)
+            batch.execute()
+        return results
 
     def delete_file(self, file_id: str):
-        creds = self._get_creds()
-        service = build("drive", "v3", credentials=creds)
+        service = self._get_service("drive", "v3")
         service.files().delete(fileId=file_id).execute()
+        self._remove_from_index(file_id)
+
+    # number of service objects built by every client
+    @staticmethod
+    def get_build_count() -> int:
+        with GoogleDriveClient._build_count_lock:
+            return GoogleDriveClient._build_count
+
+    # service objects are built once per thread, since their http transport
+    # is not thread safe, and rebuilt once the credentials are replaced
+    def _get_service(self, name: str, version: str):
+        creds = self._get_creds()
+        services = getattr(self._local, "services", None)
+        if services is None or self._local.creds is not creds:
+            services = {}
+            self._local.services = services
+            self._local.creds = creds
+        service = services.get((name, version))
+        if service is None:
+            service = build(name, version, credentials=creds)
+            services[(name, version)] = service
+            with GoogleDriveClient._build_count_lock:
+                GoogleDriveClient._build_count = GoogleDriveClient._build_count + 1
+        return service
+
+    # keeps connections alive between requests of the thread
+    def _get_session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
 
     def _get_creds(self) -> Credentials:
+        with self._creds_lock:
+            return self._load_creds()
+
+    def _load_creds(self) -> Credentials:
         if self._cached_creds is not None and self._cached_creds.valid:
             return self._cached_creds
 
@@ -364,3 +741,29 @@ class GoogleDriveClient:
 
         self._cached_creds = creds
         return self._cached_creds
+
+
+def _to_file_info(file: dict) -> GoogleDriveClient.FileInfo:
+    return GoogleDriveClient.FileInfo(
+        file.get("id"), file.get("md5Checksum"), file.get("modifiedTime")
+    )
+
+
+def _get_file_md5(file: str) -> str:
+    digest = hashlib.md5()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _get_errors(results: dict) -> dict[str, str]:
+    return {
+        key: str(result)
+        for (key, result) in results.items()
+        if isinstance(result, Exception)
+    }
+
+
+def _escape_query(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("'", "\\'")
@@ -0,0 +1,119 @@
+import hashlib
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Optional
+
+from googleapiclient.http import MediaUpload
+
+
+# resumable media uploaded while it is being written, e.g. by an image
+# encoder. write runs on a background thread into a buffer kept in memory up
+# to SPOOL_MAX_BYTES and spooled to disk past it; the buffer keeps every
+# chunk, so a resumed upload restarts from whichever offset drive
+# acknowledged. write may also copy the content to a local file.
+class StreamedUpload(MediaUpload):
+    # drive requires chunks to be a multiple of 256 KiB
+    CHUNK_SIZE = 4 * 1024 * 1024
+    SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+    # passed to write; forwards the written bytes to the upload
+    class _Sink:
+        def __init__(self, upload: "StreamedUpload"):
+            self._upload = upload
+
+        def write(self, data: bytes) -> int:
+            self._upload._write(bytes(data))
+            return len(data)
+
+    def __init__(
+        self,
+        mime_type: str,
+        write: Callable[[BinaryIO], None],
+        local_file: Optional[str] = None,
+    ):
+        self._mime_type = mime_type
+        self._buffer = tempfile.SpooledTemporaryFile(
+            max_size=StreamedUpload.SPOOL_MAX_BYTES
+        )
+        self._local = open(local_file, "wb") if local_file is not None else None
+        self._md5 = hashlib.md5()
+        self._condition = threading.Condition()
+        self._written = 0
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, args=(write,), daemon=True)
+        self._thread.start()
+
+    def chunksize(self) -> int:
+        return StreamedUpload.CHUNK_SIZE
+
+    def mimetype(self) -> str:
+        return self._mime_type
+
+    # unknown until everything is written, which lets drive take the chunks
+    # before the total size is known
+    def size(self) -> Optional[int]:
+        with self._condition:
+            return self._written if self._done else None
+
+    def resumable(self) -> bool:
+        return True
+
+    def has_stream(self) -> bool:
+        return False
+
+    def getbytes(self, begin: int, length: int) -> bytes:
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._done or self._written >= begin + length
+            )
+            self._raise_if_failed()
+            self._buffer.seek(begin)
+            return self._buffer.read(length)
+
+    # waits until the chunk from begin is written, and more after it unless
+    # writing is done, so the upload only sends a full chunk with an unknown
+    # size when it is not the last one
+    def wait_for_chunk(self, begin: int):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._done or self._written > begin + StreamedUpload.CHUNK_SIZE
+            )
+            self._raise_if_failed()
+
+    # waits until everything is written
+    def get_md5(self) -> str:
+        with self._condition:
+            self._condition.wait_for(lambda: self._done)
+            self._raise_if_failed()
+            return self._md5.hexdigest()
+
+    def close(self):
+        self._thread.join()
+        self._buffer.close()
+
+    def _run(self, write: Callable[[BinaryIO], None]):
+        try:
+            write(StreamedUpload._Sink(self))
+        except BaseException as e:
+            self._error = e
+        finally:
+            if self._local is not None:
+                self._local.close()
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def _write(self, data: bytes):
+        self._md5.update(data)
+        if self._local is not None:
+            self._local.write(data)
+        with self._condition:
+            self._buffer.seek(self._written)
+            self._buffer.write(data)
+            self._written = self._written + len(data)
+            self._condition.notify_all()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise Exception("Failed to write upload: " + str(self._error))
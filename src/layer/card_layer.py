@@ -9,6 +9,14 @@ class CardLayer(ABC):
     def render(self, onto: Image.Image) -> Image.Image:
         pass
 
+    # names of the input images the layer renders
+    def get_image_names(self) -> list[str]:
+        return []
+
+    # font files the layer renders text with
+    def get_font_files(self) -> list[str]:
+        return []
+
     @staticmethod
     def _within_box(
         outer: tuple[int, int, int, int],
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+from typing import Optional
+
+from PIL import Image, ImageChops
+
+from layer.card_layer import CardLayer
+
+
+# renders a run of static layers once and pastes the result on each render,
+# when that is exact; otherwise the layers render one by one
+class FlattenedCardLayer(CardLayer):
+    def __init__(self, layers: list[CardLayer], w: int, h: int):
+        self._layers = layers
+        self._w = w
+        self._h = h
+        self._image: Optional[Image.Image] = None
+        self._mask: Optional[Image.Image] = None
+        self._box: Optional[tuple[int, int, int, int]] = None
+        self._flattened = False
+        self._exact = False
+
+    def render(self, onto: Image.Image):
+        if not self._flattened:
+            self._flatten()
+        if not self._exact:
+            for layer in self._layers:
+                layer.render(onto)
+        elif self._box is not None:
+            onto.paste(im=self._image, box=self._box, mask=self._mask)
+
+    def get_image_names(self) -> list[str]:
+        return [n for layer in self._layers for n in layer.get_image_names()]
+
+    def get_font_files(self) -> list[str]:
+        return [f for layer in self._layers for f in layer.get_font_files()]
+
+    # layers paste and draw by blending each channel of a pixel with the
+    # destination's, never widening the gap between two destinations. so a
+    # pixel the run renders the same onto black and white is covered whatever
+    # is below it, and one it leaves black and white is left alone. when
+    # every pixel is one or the other, pasting the covered pixels is exact;
+    # partly transparent pixels would only be approximated.
+    def _flatten(self):
+        low = Image.new("RGBA", (self._w, self._h), (0, 0, 0, 0))
+        high = Image.new("RGBA", (self._w, self._h), (255, 255, 255, 255))
+        for layer in self._layers:
+            layer.render(low)
+            layer.render(high)
+        self._flattened = True
+
+        bands = ImageChops.subtract(high, low).split()
+        alpha = bands[3]
+        if any(sum(band.histogram()[1:255]) > 0 for band in bands) or any(
+            ImageChops.difference(band, alpha).getbbox() is not None
+            for band in bands[:3]
+        ):
+            return
+
+        self._exact = True
+        mask = ImageChops.invert(alpha)
+        self._box = mask.getbbox()
+        if self._box is not None:
+            self._image = low.crop(self._box)
+            self._mask = mask.crop(self._box)
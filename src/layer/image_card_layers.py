@@ -18,23 +18,13 @@ class BasicImageLayer(CardLayer):
         self._art_placement = art_placement
 
     def render(self, onto: Image.Image):
-        with self._input_provider.get_image(self._art_id) as image:
-            w_ratio = image.width / self._art_placement.w
-            h_ratio = image.height / self._art_placement.h
-            if w_ratio <= h_ratio:
-                w_resized = self._art_placement.w
-                h_resized = int(image.height / w_ratio)
-            else:
-                w_resized = int(image.width / h_ratio)
-                h_resized = self._art_placement.h
+        with self._input_provider.get_fitted_image(
+            self._art_id, self._art_placement.w, self._art_placement.h
+        ) as fitted:
+            onto.paste(im=fitted, box=to_box(self._art_placement), mask=fitted)
 
-            with image.resize((w_resized, h_resized)) as resized:
-                with resized.crop(
-                    (0, 0, self._art_placement.w, self._art_placement.h)
-                ) as cropped:
-                    onto.paste(
-                        im=cropped, box=to_box(self._art_placement), mask=cropped
-                    )
+    def get_image_names(self) -> list[str]:
+        return [self._art_id] if self._art_id is not None else []
 
 
 class SymbolRowImageLayer(CardLayer):
@@ -91,3 +81,6 @@ class SymbolRowImageLayer(CardLayer):
     def render(self, onto: Image.Image):
         for layer in self._inner_layers:
             layer.render(onto)
+
+    def get_image_names(self) -> list[str]:
+        return [n for layer in self._inner_layers for n in layer.get_image_names()]
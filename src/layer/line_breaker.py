@@ -0,0 +1,93 @@
+#!/usr/bin/python
+import re
+import weakref
+
+from PIL import ImageDraw, ImageFont
+
+# words, runs of whitespace and newlines, which are kept apart from other
+# whitespace so lines always start and end on a token boundary
+_TOKEN_PATTERN = re.compile(r"\n|[^\S\n]+|\S+")
+
+# per font memo of measured strings, shared by every text using the font
+_MEASUREMENTS: weakref.WeakKeyDictionary[
+    ImageFont.FreeTypeFont, "TextMeasurer"
+] = weakref.WeakKeyDictionary()
+
+
+# measures strings with a font, measuring each distinct string once
+class TextMeasurer:
+    def __init__(self, font: ImageFont.FreeTypeFont):
+        self._font = font
+        self._lengths: dict[str, float] = {}
+        self._bboxes: dict[str, tuple[int, int, int, int]] = {}
+
+    @staticmethod
+    def for_font(font: ImageFont.FreeTypeFont) -> "TextMeasurer":
+        measurer = _MEASUREMENTS.get(font)
+        if measurer is None:
+            measurer = TextMeasurer(font)
+            _MEASUREMENTS[font] = measurer
+        return measurer
+
+    def get_length(self, text: str) -> float:
+        length = self._lengths.get(text)
+        if length is None:
+            length = self._font.getlength(text)
+            self._lengths[text] = length
+        return length
+
+    # same as draw.textbbox((0, 0), text, font); text layers always draw onto
+    # RGBA images, so the result does not depend on the draw
+    def get_bbox(
+        self, draw: ImageDraw.ImageDraw, text: str
+    ) -> tuple[int, int, int, int]:
+        bbox = self._bboxes.get(text)
+        if bbox is None:
+            bbox = draw.textbbox((0, 0), text, self._font)
+            self._bboxes[text] = bbox
+        return bbox
+
+
+# breaks text into lines using the summed widths of its words and whitespace
+class LineBreaker:
+    def __init__(self, text: str, font: ImageFont.FreeTypeFont):
+        self._text = text
+        self._measurer = TextMeasurer.for_font(font)
+
+        # width of the text up to each token boundary
+        self._offsets: dict[int, float] = {0: 0}
+        width = 0
+        for match in _TOKEN_PATTERN.finditer(text):
+            width = width + self._measurer.get_length(match.group())
+            self._offsets[match.end()] = width
+
+    # width of text[start:end]
+    def get_length(self, start: int, end: int) -> float:
+        start_offset = self._offsets.get(start)
+        end_offset = self._offsets.get(end)
+        if start_offset is None or end_offset is None:
+            return self._measurer.get_length(self._text[start:end])
+        return end_offset - start_offset
+
+    # returns length of string starting from start that fits in
+    # the width of the box
+    def find_next_fit_length(self, start: int, width_px: int) -> int:
+        text = self._text
+        newline = text.find("\n", start)
+        end = newline if newline != -1 else len(text) - 1
+
+        # no newlines at this point
+        while end > start and self.get_length(start, end + 1) > width_px:
+            # scan from right for the next word
+            # first skip any whitespaces
+            char_seen = False
+            while end > start:
+                if text[end].isspace():
+                    if char_seen:
+                        break
+                else:
+                    char_seen = True
+
+                end = end - 1
+
+        return end - start + 1
@@ -7,14 +7,30 @@ from PIL import Image, ImageDraw, ImageFont
 
 from layer.card_layer import CardLayer
 from layer.image_card_layers import BasicImageLayer
+from layer.line_breaker import LineBreaker, TextMeasurer
+from layer.text_layout_cache import TextLayoutCache
 from param.config_enums import HorizontalAlignment, VerticalAlignment
 from provider.input_provider import InputProvider
+from util.font_cache import FontCache
 from util.placement import Placement, move_placement, to_box
 
 _DEFAULT_FONT_WINDOWS = "\\Windows\\Fonts\\constan.ttf"
 _DEFAULT_FONT_MACOS = "/System/Library/Fonts/Supplemental/Georgia.ttf"
 _DEFAULT_FONT_LINUX = "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf"
 _STARTING_FONT_SIZE = 32
+_MIN_FONT_SIZE = 8
+
+
+@dataclass
+class FitStats:
+    # number of texts fitted
+    fits: int = 0
+    layout_passes: int = 0
+    # passes needed when trying each size down from the starting size
+    linear_layout_passes: int = 0
+
+
+_FIT_STATS = FitStats()
 
 
 class EmbeddedImageTextCardLayer(CardLayer):
@@ -23,6 +39,39 @@ class EmbeddedImageTextCardLayer(CardLayer):
         place: Placement
         image_id: str
 
+    @dataclass
+    class Layout:
+        font_size: int
+        spacing: int
+        multiline_text: str
+        embeds: list["EmbeddedImageTextCardLayer.EmbeddedImage"]
+        text_box: tuple[int, int, int, int]
+
+        def to_dict(self) -> dict:
+            return {
+                "font_size": self.font_size,
+                "spacing": self.spacing,
+                "multiline_text": self.multiline_text,
+                "embeds": [
+                    [e.place.x, e.place.y, e.place.w, e.place.h, e.image_id]
+                    for e in self.embeds
+                ],
+                "text_box": list(self.text_box),
+            }
+
+        @staticmethod
+        def from_dict(d: dict) -> "EmbeddedImageTextCardLayer.Layout":
+            return EmbeddedImageTextCardLayer.Layout(
+                d["font_size"],
+                d["spacing"],
+                d["multiline_text"],
+                [
+                    EmbeddedImageTextCardLayer.EmbeddedImage(Placement(*e[:4]), e[4])
+                    for e in d["embeds"]
+                ],
+                tuple(d["text_box"]),
+            )
+
     def __init__(
         self,
         text: str,
@@ -64,47 +113,127 @@ class EmbeddedImageTextCardLayer(CardLayer):
         self._color = color or "#000000"
 
     def render(self, onto: Image.Image):
-        outer_box = CardLayer._move_box((0, 0), to_box(self._placement))
-        font_size = self._starting_font_size
         draw = ImageDraw.Draw(onto, "RGBA")
-
-        while True:
-            font = ImageFont.truetype(self._font_file, font_size)
-            spacing = int(self._spacing_ratio * font.getbbox(" ")[3])
-
-            (text_lines, embeds) = self._split_lines_and_place_embeds(
-                draw, font, spacing
-            )
-            multiline_text = "\n".join(text_lines)
-
-            text_box = draw.multiline_textbbox(
-                (0, 0),
-                multiline_text,
-                font,
-                spacing=spacing,
-            )
-
-            if CardLayer._within_box(outer_box, text_box, 5):
-                break
-
-            font_size = font_size - 1
-            if font_size < 8:
-                print("Warning: failed to fit text in a box: " + self._text)
-                break
+        layout = self._fit(draw)
+        font = FontCache.get(self._font_file, layout.font_size)
+        text_box = layout.text_box
 
         v_offset = _get_v_offset(self._v_alignment, self._placement, text_box)
         h_offset = _get_h_offset(self._h_alignment, self._placement, text_box)
         draw.multiline_text(
             (self._placement.x + h_offset, self._placement.y + v_offset),
-            multiline_text,
+            layout.multiline_text,
             font=font,
             fill=self._color,
-            spacing=spacing,
+            spacing=layout.spacing,
             align="" + self._h_alignment,
         )
 
         embed_v_offset = int(self._embed_v_offset_ratio * font.getbbox(" ")[3])
-        self._render_embeds(embeds, (h_offset, v_offset + embed_v_offset), onto)
+        self._render_embeds(layout.embeds, (h_offset, v_offset + embed_v_offset), onto)
+
+    def get_image_names(self) -> list[str]:
+        return self._get_embed_ids()
+
+    def get_font_files(self) -> list[str]:
+        return [self._font_file]
+
+    # ids of the images embedded in the text
+    def _get_embed_ids(self) -> list[str]:
+        return sorted(
+            {
+                self._embedding_map[word]
+                for word in self._text.split()
+                if word in self._embedding_map
+            }
+        )
+
+    # layouts are memoized across cards (and runs, if the cache is persisted)
+    def _fit(self, draw: ImageDraw.ImageDraw) -> Layout:
+        key = TextLayoutCache.get_key(self._get_layout_key_parts())
+        stored = TextLayoutCache.get(key)
+        if stored is not None:
+            return EmbeddedImageTextCardLayer.Layout.from_dict(stored)
+
+        layout = self._fit_font_size(draw)
+        TextLayoutCache.put(key, layout.to_dict())
+        return layout
+
+    # everything the layout depends on; alignment only offsets the layout
+    def _get_layout_key_parts(self) -> list:
+        embed_sizes = []
+        for embed_id in self._get_embed_ids():
+            with self._input_provider.get_image(embed_id) as embed_image:
+                embed_sizes.append([embed_id, embed_image.width, embed_image.height])
+
+        return [
+            self._text,
+            to_box(self._placement),
+            FontCache.get_digest(self._font_file),
+            self._starting_font_size,
+            self._spacing_ratio,
+            sorted(self._embedding_map.items()),
+            self._embed_v_offset_ratio,
+            self._embed_size_ratio,
+            embed_sizes,
+        ]
+
+    # finds the largest font size from the starting size down to
+    # _MIN_FONT_SIZE that fits the text in the box, by bisection. text only
+    # grows with the font size, so this matches trying every size in turn.
+    def _fit_font_size(self, draw: ImageDraw.ImageDraw) -> Layout:
+        outer_box = CardLayer._move_box((0, 0), to_box(self._placement))
+        layouts: dict[int, EmbeddedImageTextCardLayer.Layout] = {}
+
+        def fits(font_size: int) -> bool:
+            layouts[font_size] = self._layout(draw, font_size)
+            return CardLayer._within_box(outer_box, layouts[font_size].text_box, 5)
+
+        # lo starts just below the smallest size, as if that size fit
+        hi = self._starting_font_size
+        lowest = min(_MIN_FONT_SIZE, hi)
+        lo = lowest - 1
+        if fits(hi):
+            lo = hi
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if fits(mid):
+                lo = mid
+            else:
+                hi = mid
+
+        chosen = lo
+        if chosen < lowest:
+            print("Warning: failed to fit text in a box: " + self._text)
+            chosen = lowest
+
+        _FIT_STATS.fits = _FIT_STATS.fits + 1
+        _FIT_STATS.layout_passes = _FIT_STATS.layout_passes + len(layouts)
+        _FIT_STATS.linear_layout_passes = (
+            _FIT_STATS.linear_layout_passes + self._starting_font_size - chosen + 1
+        )
+        return layouts[chosen]
+
+    def _layout(self, draw: ImageDraw.ImageDraw, font_size: int) -> Layout:
+        font = FontCache.get(self._font_file, font_size)
+        spacing = int(self._spacing_ratio * font.getbbox(" ")[3])
+
+        (text_lines, embeds) = self._split_lines_and_place_embeds(draw, font, spacing)
+        multiline_text = "\n".join(text_lines)
+
+        text_box = draw.multiline_textbbox(
+            (0, 0),
+            multiline_text,
+            font,
+            spacing=spacing,
+        )
+        return EmbeddedImageTextCardLayer.Layout(
+            font_size, spacing, multiline_text, embeds, text_box
+        )
+
+    @staticmethod
+    def get_fit_stats() -> FitStats:
+        return FitStats(**vars(_FIT_STATS))
 
     def _split_lines_and_place_embeds(
         self,
@@ -114,16 +243,18 @@ class EmbeddedImageTextCardLayer(CardLayer):
     ) -> tuple[list[str], list[EmbeddedImage]]:
         lines = []
         embeds = []
-        line_height = draw.textbbox((0, 0), " ", font)[3]
+        measurer = TextMeasurer.for_font(font)
+        line_height = measurer.get_bbox(draw, " ")[3]
         line_and_spacing_height = line_height + spacing
 
         (padded_text, embeddings) = self._pad_embeddings(draw, font)
+        line_breaker = LineBreaker(padded_text, font)
 
         embeddings.sort(key=(lambda ei: ei[0]))
         i_embeddings = 0
         i_text = 0
         while i_text < len(padded_text):
-            length = _find_next_fit_length(padded_text, i_text, font, self._placement.w)
+            length = line_breaker.find_next_fit_length(i_text, self._placement.w)
 
             if length == 0:
                 print("Warning: unable to fit text a row")
@@ -140,7 +271,7 @@ class EmbeddedImageTextCardLayer(CardLayer):
                 # x offset for the preceding text and the spacing due to embedding size ratio
                 x = (
                     self._placement.x
-                    + draw.textbbox((0, 0), padded_text[i_text : embed[0]], font)[2]
+                    + measurer.get_bbox(draw, padded_text[i_text : embed[0]])[2]
                     + (embed_size[1] - embed_size[1] * self._embed_size_ratio) / 2
                 )
 
@@ -171,7 +302,7 @@ class EmbeddedImageTextCardLayer(CardLayer):
     # returns (padded_string, embeddings)
     # embeddings: list of (index in padded text, embedding id, image size)
     def _pad_embeddings(
-        self, draw: ImageDraw.ImageDraw, font: ImageFont.ImageFont
+        self, draw: ImageDraw.ImageDraw, font: ImageFont.FreeTypeFont
     ) -> tuple[str, list[tuple[int, str, tuple[int, int]]]]:
         index = 0
         total_padding = 0
@@ -219,49 +350,25 @@ class EmbeddedImageTextCardLayer(CardLayer):
 
     # gets the padding string and the size of the embed the padding is for
     def _get_padding_str(
-        self, embed_file: str, draw: ImageDraw.ImageDraw, font: ImageFont.ImageFont
+        self, embed_file: str, draw: ImageDraw.ImageDraw, font: ImageFont.FreeTypeFont
     ) -> tuple[str, tuple[int, int]]:
+        measurer = TextMeasurer.for_font(font)
         with self._input_provider.get_image(embed_file) as embed_image:
             # the padding should have similar w/h ratio as the embedding
             image_w_h_ratio = embed_image.width / embed_image.height
-            height_px = draw.textbbox((0, 0), " ", font)[3]
+            height_px = measurer.get_bbox(draw, " ")[3]
             target_width = image_w_h_ratio * height_px
             padding = " "
-            while draw.textbbox((0, 0), padding, font)[2] < target_width:
+            while measurer.get_bbox(draw, padding)[2] < target_width:
                 padding = padding + " "
 
-            w_ratio = embed_image.width / draw.textbbox((0, 0), padding, font)[2]
+            w_ratio = embed_image.width / measurer.get_bbox(draw, padding)[2]
             return (
                 padding,
                 (int(embed_image.width / w_ratio), int(embed_image.height / w_ratio)),
             )
 
 
-# returns length of string starting from start that fits in
-# the width of the box
-def _find_next_fit_length(
-    text: str, start: int, font: ImageFont.FreeTypeFont, width_px: int
-) -> int:
-    newline = text[start:].find("\n")
-    end = start + newline if newline != -1 else len(text) - 1
-
-    # no newlines at this point
-    while end > start and font.getlength(text[start : end + 1]) > width_px:
-        # scan from right for the next word
-        # first skip any whitespaces
-        char_seen = False
-        while end > start:
-            if text[end].isspace():
-                if char_seen:
-                    break
-            else:
-                char_seen = True
-
-            end = end - 1
-
-    return end - start + 1
-
-
 # determines the vertical offset for a box the size of bbox align
 def _get_v_offset(
     v_alignment: Optional[VerticalAlignment],
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+import hashlib
+import json
+import os
+import threading
+from abc import ABC
+from collections import OrderedDict
+from typing import Optional
+
+from util.lru_cache import CacheStats
+
+
+# process-wide memo of fitted text layouts, optionally persisted to a json
+# file so reruns of an unchanged deck skip text layout entirely. layouts are
+# json-compatible dicts keyed by a digest of everything the layout depends on.
+class TextLayoutCache(ABC):
+    MAX_STORED_ENTRIES = 10000
+
+    _lock = threading.Lock()
+    _layouts: OrderedDict[str, dict] = OrderedDict()
+    _file: Optional[str] = None
+    _stats = CacheStats()
+
+    @staticmethod
+    def get_key(key_parts: list) -> str:
+        return hashlib.sha1(json.dumps(key_parts).encode()).hexdigest()
+
+    @staticmethod
+    def get(key: str) -> Optional[dict]:
+        with TextLayoutCache._lock:
+            layout = TextLayoutCache._layouts.get(key)
+            if layout is None:
+                TextLayoutCache._stats.misses = TextLayoutCache._stats.misses + 1
+                return None
+            TextLayoutCache._layouts.move_to_end(key)
+            TextLayoutCache._stats.hits = TextLayoutCache._stats.hits + 1
+            return layout
+
+    @staticmethod
+    def put(key: str, layout: dict):
+        with TextLayoutCache._lock:
+            TextLayoutCache._layouts[key] = layout
+            TextLayoutCache._stats.entries = len(TextLayoutCache._layouts)
+
+    # loads layouts stored by a previous run and saves to the same file
+    @staticmethod
+    def open(file: str):
+        with TextLayoutCache._lock:
+            TextLayoutCache._file = file
+            if not os.path.exists(file):
+                return
+            try:
+                with open(file, "r") as f:
+                    TextLayoutCache._layouts.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print("Warning: ignoring text layout cache '" + file + "': " + str(e))
+            TextLayoutCache._stats.entries = len(TextLayoutCache._layouts)
+
+    # stores the most recently used layouts if a file was opened
+    @staticmethod
+    def save():
+        with TextLayoutCache._lock:
+            if TextLayoutCache._file is None:
+                return
+            keys = list(TextLayoutCache._layouts.keys())
+            stored = {
+                k: TextLayoutCache._layouts[k]
+                for k in keys[-TextLayoutCache.MAX_STORED_ENTRIES :]
+            }
+            folder = os.path.dirname(os.path.abspath(TextLayoutCache._file))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(TextLayoutCache._file, "w") as f:
+                json.dump(stored, f)
+
+    @staticmethod
+    def stats() -> CacheStats:
+        with TextLayoutCache._lock:
+            return CacheStats(**vars(TextLayoutCache._stats))
@@ -45,3 +45,9 @@ class HorizontalAlignment(StrEnum):
 class ImageLayout(StrEnum):
     SHEET = "sheet"
     SINGLETON = "singleton"
+
+
+class ImageFormat(StrEnum):
+    PNG = "png"
+    WEBP = "webp"
+    JPEG = "jpeg"
@@ -1,17 +1,42 @@
 #!/usr/bin/python
+import hashlib
+import json
 import os
+import threading
 from abc import ABC, abstractmethod
 
+from typing import Optional
+
 import PIL.Image
-from csv import DictReader
+from csv import DictReader, DictWriter
 
 
 from google.google_drive_client import GoogleDriveClient
 from param.config_enums import InputProviderType
 from util.helpers import Helpers as h
+from util.lru_cache import CacheStats, LRUCache
 
 
 class InputProvider(ABC):
+    DEFAULT_IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    DEFAULT_FITTED_IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, config: dict):
+        self._image_cache = LRUCache(
+            _get_max_bytes(
+                config,
+                "input/image_cache_max_bytes",
+                InputProvider.DEFAULT_IMAGE_CACHE_MAX_BYTES,
+            )
+        )
+        self._fitted_image_cache = LRUCache(
+            _get_max_bytes(
+                config,
+                "input/fitted_image_cache_max_bytes",
+                InputProvider.DEFAULT_FITTED_IMAGE_CACHE_MAX_BYTES,
+            )
+        )
+
     @classmethod
     @property
     @abstractmethod
@@ -22,8 +47,54 @@ class InputProvider(ABC):
     def get_decklist(self, name: str) -> list[dict[str, str]]:
         pass
 
-    @abstractmethod
+    # returns a read-only view of the decoded image; the first write to the
+    # view (e.g. paste) copies it so the cached image is never modified
     def get_image(self, name: str) -> PIL.Image.Image:
+        image = self._image_cache.get(name)
+        if image is None:
+            with self._open_image(name) as opened:
+                opened.load()
+                image = opened._new(opened.im)
+            self._image_cache.put(name, image, _image_size_bytes(image))
+
+        view = image._new(image.im)
+        view.readonly = 1
+        return view
+
+    # returns a read-only view of the image scaled to cover w x h (preserving
+    # its aspect ratio) and cropped to w x h from the top left
+    def get_fitted_image(
+        self, name: str, w: int, h: int, resample: Optional[int] = None
+    ) -> PIL.Image.Image:
+        key = (name, w, h, resample)
+        fitted = self._fitted_image_cache.get(key)
+        if fitted is None:
+            with self.get_image(name) as image:
+                fitted = _fit_image(image, w, h, resample)
+            self._fitted_image_cache.put(key, fitted, _image_size_bytes(fitted))
+
+        view = fitted._new(fitted.im)
+        view.readonly = 1
+        return view
+
+    # drops the cached copies of an image whose file changed
+    def invalidate_image(self, name: str):
+        self._image_cache.invalidate(name)
+        self._fitted_image_cache.invalidate_matching(lambda key: key[0] == name)
+
+    # returns a digest of the image file's contents
+    @abstractmethod
+    def get_image_digest(self, name: str) -> str:
+        pass
+
+    def get_image_cache_stats(self) -> CacheStats:
+        return self._image_cache.stats()
+
+    def get_fitted_image_cache_stats(self) -> CacheStats:
+        return self._fitted_image_cache.stats()
+
+    @abstractmethod
+    def _open_image(self, name: str) -> PIL.Image.Image:
         pass
 
 
@@ -49,7 +120,10 @@ class LocalInputProvider(InputProvider):
         return InputProviderType.LOCAL
 
     def __init__(self, config: dict):
+        super().__init__(config)
         self._folder = os.path.abspath(h.require(config, "input/folder"))
+        # file name to (modification time, size, digest)
+        self._digests: dict[str, tuple[int, int, str]] = {}
 
     def get_decklist(self, name: str) -> list[dict[str, str]]:
         with open(
@@ -57,27 +131,188 @@ class LocalInputProvider(InputProvider):
         ) as f:
             return list(DictReader(f.readlines(), delimiter=","))
 
-    def get_image(self, name: str) -> PIL.Image.Image:
+    # files are only read again once modified
+    def get_image_digest(self, name: str) -> str:
+        file = os.path.join(self._folder, name)
+        stat = os.stat(file)
+        stored = self._digests.get(name)
+        if stored is not None and stored[:2] == (stat.st_mtime_ns, stat.st_size):
+            return stored[2]
+
+        digest = _get_file_digest(file)
+        self._digests[name] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def _open_image(self, name: str) -> PIL.Image.Image:
         return PIL.Image.open(os.path.join(self._folder, name))
 
 
+# temp_folder is a persistent cache of the drive folder: a downloaded file is
+# reused while its checksum and modification time match drive's, and in
+# offline mode everything is read from the cache without contacting drive
 class GoogleInputProvider(InputProvider):
+    # what was downloaded into the temp folder, by name
+    _DOWNLOADS_FILE = ".downloads.json"
+
     @classmethod
     @property
     def TYPE(cls) -> InputProviderType:
         return InputProviderType.GOOGLE
 
     def __init__(self, config: dict):
+        super().__init__(config)
         self._client = GoogleDriveClient(h.require(config, "google_secrets_path"))
         self._folder = h.require(config, "input/folder")
         self._temp_folder = os.path.abspath(h.require(config, "input/temp_folder"))
         if not os.path.exists(self._temp_folder):
             os.makedirs(self._temp_folder)
+        self._offline = bool(h.dont_require(config, "input/offline"))
 
+        self._lock = threading.Lock()
+        # one lock per file, so concurrent requests share a download
+        self._file_locks: dict[str, threading.Lock] = {}
+        # files checked against drive by this provider
+        self._checked: set[str] = set()
+        self._downloads_file = os.path.join(
+            self._temp_folder, GoogleInputProvider._DOWNLOADS_FILE
+        )
+        self._downloads: dict[str, dict] = {}
+        if os.path.exists(self._downloads_file):
+            try:
+                with open(self._downloads_file, "r") as f:
+                    self._downloads = json.load(f)
+            except (OSError, ValueError) as e:
+                print(
+                    "Warning: ignoring download cache '"
+                    + self._downloads_file
+                    + "': "
+                    + str(e)
+                )
+
+    # the decklist is kept in the temp folder for offline runs
     def get_decklist(self, name: str) -> list[dict[str, str]]:
-        return list(self._client.download_csv(name, self._folder))
+        temp_file = os.path.join(
+            self._temp_folder, name if name.endswith(".csv") else name + ".csv"
+        )
+        if self._offline:
+            if not os.path.exists(temp_file):
+                raise Exception(
+                    "Decklist '" + name + "' was not downloaded before going offline"
+                )
+            with open(temp_file, "r", newline="") as f:
+                return list(DictReader(f, delimiter=","))
 
-    def get_image(self, name: str) -> PIL.Image.Image:
+        reader = self._client.download_csv(name, self._folder)
+        rows = list(reader)
+        with open(temp_file, "w", newline="") as f:
+            writer = DictWriter(f, fieldnames=reader.fieldnames or [])
+            writer.writeheader()
+            writer.writerows(rows)
+        return rows
+
+    # drive's checksum identifies the contents without downloading them
+    def get_image_digest(self, name: str) -> str:
+        if self._offline:
+            download = self._get_download(name)
+            return download["md5_checksum"] or download["modified_time"]
+
+        info = self._get_file_info(name)
+        return info.md5_checksum or info.modified_time
+
+    def _open_image(self, name: str) -> PIL.Image.Image:
+        return PIL.Image.open(self._get_temp_file(name))
+
+    # returns the downloaded file, downloading it first unless the cached
+    # copy is current
+    def _get_temp_file(self, name: str) -> str:
         temp_file = os.path.join(self._temp_folder, name)
-        self._client.download_file(name, temp_file, self._folder)
-        return PIL.Image.open(temp_file)
+        with self._lock:
+            file_lock = self._file_locks.setdefault(name, threading.Lock())
+        with file_lock:
+            if name in self._checked:
+                return temp_file
+            if self._offline:
+                self._get_download(name)
+                self._checked.add(name)
+                return temp_file
+
+            info = self._get_file_info(name)
+            with self._lock:
+                download = self._downloads.get(name)
+            if (
+                download is None
+                or download["md5_checksum"] != info.md5_checksum
+                or download["modified_time"] != info.modified_time
+                or download["file"] != h.get_file_state(temp_file)
+            ):
+                # downloaded beside the file, so a failed download leaves the
+                # cached copy as it was
+                part_file = temp_file + ".part"
+                self._client.download_file(info.id, part_file, None)
+                os.replace(part_file, temp_file)
+                with self._lock:
+                    self._downloads[name] = {
+                        "md5_checksum": info.md5_checksum,
+                        "modified_time": info.modified_time,
+                        "file": h.get_file_state(temp_file),
+                    }
+                    self._save_downloads()
+            self._checked.add(name)
+            return temp_file
+
+    def _get_file_info(self, name: str) -> GoogleDriveClient.FileInfo:
+        info = self._client.get_file_info(name, self._folder)
+        if info is None:
+            raise Exception(
+                "Could not find '" + name + "' in drive folder " + self._folder
+            )
+        return info
+
+    # returns the record of a cached file, which must be unchanged
+    def _get_download(self, name: str) -> dict:
+        with self._lock:
+            download = self._downloads.get(name)
+        if download is None or download["file"] != h.get_file_state(
+            os.path.join(self._temp_folder, name)
+        ):
+            raise Exception("'" + name + "' was not downloaded before going offline")
+        return download
+
+    def _save_downloads(self):
+        temp_file = self._downloads_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self._downloads, f)
+        os.replace(temp_file, self._downloads_file)
+
+
+def _get_file_digest(file: str) -> str:
+    digest = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _image_size_bytes(image: PIL.Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def _get_max_bytes(config: dict, key: str, default: int) -> int:
+    max_bytes = h.dont_require(config, key)
+    return default if max_bytes is None else int(max_bytes)
+
+
+def _fit_image(
+    image: PIL.Image.Image, w: int, h: int, resample: Optional[int]
+) -> PIL.Image.Image:
+    w_ratio = image.width / w
+    h_ratio = image.height / h
+    if w_ratio <= h_ratio:
+        w_resized = w
+        h_resized = int(image.height / w_ratio)
+    else:
+        w_resized = int(image.width / h_ratio)
+        h_resized = h
+
+    with image.resize((w_resized, h_resized), resample) as resized:
+        return resized.crop((0, 0, w, h))
@@ -2,12 +2,15 @@
 import json
 import os
 from abc import ABC, abstractmethod
+from typing import Optional
 
 import PIL.Image
 
 from google.google_drive_client import GoogleDriveClient
 from param.config_enums import OutputProviderType
+from util.banded_image import BandedImage
 from util.helpers import Helpers as h
+from util.image_encoder import ImageEncoder
 
 
 class OutputProvider(ABC):
@@ -18,13 +21,18 @@ class OutputProvider(ABC):
         pass
 
     @abstractmethod
-    def save_image(self, img: PIL.Image.Image, name: str) -> str:
+    def save_image(self, img: PIL.Image.Image | BandedImage, name: str) -> str:
         pass
 
     @abstractmethod
     def save_json(self, j: dict, name: str) -> str:
         pass
 
+    # local folder the saved files are written to
+    @abstractmethod
+    def get_local_folder(self) -> str:
+        pass
+
 
 class OutputProviderFactory(ABC):
     _DEFAULT = OutputProviderType.LOCAL
@@ -51,13 +59,11 @@ class LocalOutputProvider(OutputProvider):
         self._folder = os.path.abspath(h.require(config, "output/folder"))
         if not os.path.exists(self._folder):
             os.makedirs(self._folder)
+        self._encoder = ImageEncoder.build(config)
 
-    def save_image(self, img: PIL.Image.Image, name: str) -> str:
+    def save_image(self, img: PIL.Image.Image | BandedImage, name: str) -> str:
         output_file = os.path.join(self._folder, name)
-        img.save(
-            output_file,
-            format=name.split(".")[-1] if "." in name else "png",
-        )
+        self._encoder.save(img, output_file)
         return output_file
 
     def save_json(self, j: dict, name: str) -> str:
@@ -66,6 +72,9 @@ class LocalOutputProvider(OutputProvider):
             json.dump(j, f, indent=4)
         return out_file
 
+    def get_local_folder(self) -> str:
+        return self._folder
+
 
 class GoogleOutputProvider(OutputProvider):
     @classmethod
@@ -79,14 +88,38 @@ class GoogleOutputProvider(OutputProvider):
         self._temp_folder = os.path.abspath(h.require(config, "output/temp_folder"))
         if not os.path.exists(self._temp_folder):
             os.makedirs(self._temp_folder)
-
-    def save_image(self, img: PIL.Image.Image, name: str) -> str:
-        temp_file = os.path.join(self._temp_folder, name)
-        img.save(temp_file, format=name.split(".")[-1] if "." in name else "png")
-        return self._client.create_or_update_png(temp_file, self._folder, name)
+        # incremental builds reuse the previous sheets from the temp folder
+        self._keep_local = bool(h.dont_require(config, "cache/incremental"))
+        self._encoder = ImageEncoder.build(config)
+
+    # files are encoded straight into the upload, which starts before the
+    # encoding finishes, and only written to the temp folder when kept
+    def save_image(self, img: PIL.Image.Image | BandedImage, name: str) -> str:
+        return self._client.create_or_update_streamed(
+            self._encoder.get_mime_type(),
+            lambda f: self._encoder.save(img, f),
+            self._folder,
+            name,
+            self._get_local_file(name),
+        )
 
     def save_json(self, j: dict, name: str) -> str:
-        temp_file = os.path.join(self._temp_folder, name)
-        with open(temp_file, "w") as f:
-            json.dump(j, f, indent=4)
-        return self._client.create_or_update_json(temp_file, self._folder, name)
+        data = json.dumps(j, indent=4).encode()
+        return self._client.create_or_update_streamed(
+            "application/json",
+            lambda f: f.write(data),
+            self._folder,
+            name,
+            self._get_local_file(name),
+        )
+
+    def get_local_folder(self) -> str:
+        return self._temp_folder
+
+    # files already in the output folder with the same content are not
+    # uploaded again
+    def get_upload_stats(self) -> GoogleDriveClient.UploadStats:
+        return self._client.get_upload_stats()
+
+    def _get_local_file(self, name: str) -> Optional[str]:
+        return os.path.join(self._temp_folder, name) if self._keep_local else None
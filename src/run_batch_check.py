@@ -0,0 +1,143 @@
+#!/usr/bin/python
+import argparse
+import http.server
+import json
+import re
+import threading
+
+import httplib2
+from googleapiclient.discovery import build
+from googleapiclient.http import BatchHttpRequest
+
+from google.google_drive_client import GoogleDriveClient
+
+# the id of the file the stand-in server answers with an error
+_MISSING_ID = "missing"
+
+
+# a stand-in for google drive that answers every request of a batch, and
+# counts the http requests and the batched requests it receives
+class _BatchHandler(http.server.BaseHTTPRequestHandler):
+    counts_lock = threading.Lock()
+    http_requests = 0
+    batched_requests = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        boundary = re.search(
+            r'boundary="?([^";]+)', self.headers["Content-Type"]
+        ).group(1)
+        parts = [part for part in body.split("--" + boundary) if "Content-ID" in part]
+        with _BatchHandler.counts_lock:
+            _BatchHandler.http_requests = _BatchHandler.http_requests + 1
+            _BatchHandler.batched_requests = _BatchHandler.batched_requests + len(parts)
+
+        responses = []
+        for part in parts:
+            content_id = re.search(r"Content-ID: <([^>]+)>", part).group(1)
+            path = re.search(r"\n(?:GET|POST|DELETE) (\S+)", part).group(1)
+            if "/" + _MISSING_ID in path:
+                (status, payload) = (
+                    "404 Not Found",
+                    {"error": {"code": 404, "message": "File not found"}},
+                )
+            else:
+                (status, payload) = ("200 OK", {"id": "permission"})
+            responses.append(
+                "--batch\r\n"
+                + "Content-Type: application/http\r\n"
+                + "Content-ID: <response-"
+                + content_id
+                + ">\r\n\r\n"
+                + "HTTP/1.1 "
+                + status
+                + "\r\nContent-Type: application/json\r\n\r\n"
+                + json.dumps(payload)
+                + "\r\n"
+            )
+        data = ("".join(responses) + "--batch--\r\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/mixed; boundary=batch")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def take_counts() -> tuple[int, int]:
+        with _BatchHandler.counts_lock:
+            counts = (_BatchHandler.http_requests, _BatchHandler.batched_requests)
+            _BatchHandler.http_requests = 0
+            _BatchHandler.batched_requests = 0
+        return counts
+
+
+# a client sending its requests to the stand-in server, without credentials
+class _LocalDriveClient(GoogleDriveClient):
+    def __init__(self, url: str):
+        super().__init__("")
+        self._url = url
+
+    def _get_service(self, name: str, version: str):
+        service = build(
+            name,
+            version,
+            http=httplib2.Http(),
+            static_discovery=True,
+            client_options={"api_endpoint": self._url},
+        )
+        # batches go to the root url, which the endpoint does not replace
+        service.new_batch_http_request = lambda callback=None: BatchHttpRequest(
+            callback=callback, batch_uri=self._url + "batch/drive/v3"
+        )
+        return service
+
+
+# runs the call and raises unless it sent the expected number of http
+# requests and reported only the missing file
+def _check(name: str, call, num_files: int):
+    file_ids = ["file" + str(i) for i in range(num_files - 1)] + [_MISSING_ID]
+    errors = call(file_ids)
+    (http_requests, batched_requests) = _BatchHandler.take_counts()
+    expected = -(-num_files // GoogleDriveClient._BATCH_SIZE)
+    print(
+        "{}: {} files in {} http requests ({} batched), {} errors".format(
+            name, num_files, http_requests, batched_requests, len(errors)
+        )
+    )
+    if http_requests != expected or batched_requests != num_files:
+        raise Exception(
+            "{} sent {} http requests for {} files, expected {}".format(
+                name, http_requests, num_files, expected
+            )
+        )
+    if list(errors) != [_MISSING_ID]:
+        raise Exception(
+            "{} reported errors for {}, expected only '{}'".format(
+                name, list(errors), _MISSING_ID
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks against a local stand-in for google drive that files are shared and deleted in batches."
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=251,
+        help="Number of files to share and delete, the last of which is missing.",
+    )
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _BatchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = _LocalDriveClient("http://127.0.0.1:" + str(server.server_port) + "/")
+        _check("share_files", client.share_files, args.files)
+        _check("delete_files", client.delete_files, args.files)
+    finally:
+        server.shutdown()
@@ -0,0 +1,212 @@
+#!/usr/bin/python
+import argparse
+import contextlib
+import io
+import socket
+import sys
+import threading
+import time
+from typing import Optional
+
+from card.card_builder import CardBuilder
+from deck.deck_builder import DeckBuilder
+from gen.generator import Generator
+from google.google_drive_client import GoogleDriveClient
+from layer.text_card_layers import EmbeddedImageTextCardLayer
+from layer.text_layout_cache import TextLayoutCache
+from param.config_enums import InputProviderType
+from param.input_parameters import InputParameterBuilder
+from provider.input_provider import InputProviderFactory
+from util.banded_image import BandedImage
+from util.helpers import Helpers as h
+from util.image_encoder import ImageEncoder
+
+_connections_lock = threading.Lock()
+_connections = 0
+
+# output/encoding settings compared by --encodings
+_ENCODINGS = [
+    ("png", {}),
+    ("png, compress_level 1", {"compress_level": 1}),
+    ("png, compress_level 9", {"compress_level": 9}),
+    ("png, 4 workers", {"workers": 4}),
+    ("png, opaque_to_rgb", {"opaque_to_rgb": True}),
+    ("png, 256 colors", {"quantize_colors": 256}),
+    ("webp, lossless", {"format": "webp", "lossless": True}),
+    ("webp, quality 90", {"format": "webp", "quality": 90}),
+    ("jpeg, quality 90", {"format": "jpeg", "quality": 90}),
+]
+
+
+# counts the sockets this process connects, e.g. to google's apis
+def _count_connections():
+    connect = socket.socket.connect
+
+    def _counted_connect(sock, address):
+        global _connections
+        with _connections_lock:
+            _connections = _connections + 1
+        return connect(sock, address)
+
+    socket.socket.connect = _counted_connect
+
+
+# encodes the image with each setting, adding up the seconds and bytes
+def _encode(image, totals: list[tuple[float, int]]):
+    for i, (_, encoding) in enumerate(_ENCODINGS):
+        encoder = ImageEncoder(encoding)
+        with io.BytesIO() as f:
+            start = time.perf_counter()
+            encoder.save(image, f)
+            elapsed = time.perf_counter() - start
+            totals[i] = (totals[i][0] + elapsed, totals[i][1] + f.tell())
+
+
+# returns the peak RSS in MiB of this process and, with workers, of the
+# largest render worker, or None where it can't be measured
+def _get_peak_rss(with_workers: bool) -> Optional[list[tuple[str, float]]]:
+    try:
+        import resource
+    except ImportError:
+        # not available on windows
+        return None
+
+    # kilobytes on linux, bytes on macOS
+    unit = 1 if sys.platform.startswith("darwin") else 1024
+    usages = [("this process", resource.RUSAGE_SELF)]
+    if with_workers:
+        usages.append(("the largest render worker", resource.RUSAGE_CHILDREN))
+    return [
+        (name, resource.getrusage(who).ru_maxrss * unit / (1024 * 1024))
+        for (name, who) in usages
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Renders a deck without saving it and reports timings and counters."
+    )
+    parser.add_argument(
+        "--gen_config",
+        type=str,
+        required=True,
+        help="Path to json-formatted generation configuration.",
+    )
+    parser.add_argument(
+        "--deck_config",
+        type=str,
+        required=True,
+        help="Path to json-formatted deck configuration.",
+    )
+    parser.add_argument(
+        "--decklist",
+        type=str,
+        required=True,
+        help="Path or name of the decklist to render.",
+    )
+    parser.add_argument(
+        "--cards",
+        type=int,
+        required=False,
+        help="Render a synthetic deck of this many cards, one per decklist row, cycling through the rows.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        help="Number of processes rendering cards, overriding output/render_workers.",
+    )
+    parser.add_argument(
+        "--encodings",
+        action="store_true",
+        help="Also encode the rendered images with several output/encoding settings and report their time and size.",
+    )
+    parser.add_argument(
+        "--max_rss_mib",
+        type=float,
+        required=False,
+        help="Fail if the peak RSS of this process or of a render worker exceeds this many MiB.",
+    )
+    args = parser.parse_args()
+
+    params = InputParameterBuilder.build(
+        args.gen_config, args.deck_config, args.decklist
+    )
+    if args.workers is not None:
+        params.config.setdefault("output", {})["render_workers"] = args.workers
+    _count_connections()
+    input_provider = InputProviderFactory.build(params.config)
+
+    start = time.perf_counter()
+    if args.cards is None:
+        deck = Generator.gen_deck(params, input_provider)
+    else:
+        rows = [
+            row
+            for row in input_provider.get_decklist(params.decklist)
+            if not bool(row.get("skip"))
+        ]
+        deck = DeckBuilder(
+            CardBuilder(params.config, input_provider), params.config
+        ).build(
+            params.deck_name,
+            [rows[i % len(rows)] | {"count": "1"} for i in range(args.cards)],
+        )
+    num_images = 0
+    encode_totals = [(0.0, 0)] * len(_ENCODINGS)
+    encode_elapsed = 0.0
+    for rendered in deck.render():
+        num_images = num_images + 1
+        with contextlib.closing(rendered) as image:
+            if isinstance(image, BandedImage):
+                if not args.encodings:
+                    # a sheet renders as its bands are read
+                    for _ in image.get_bands():
+                        pass
+                    continue
+                image = image.to_image()
+            with contextlib.closing(image):
+                if args.encodings:
+                    encode_start = time.perf_counter()
+                    _encode(image, encode_totals)
+                    encode_elapsed = encode_elapsed + time.perf_counter() - encode_start
+    elapsed = time.perf_counter() - start - encode_elapsed
+
+    print(
+        "Rendered {} cards into {} images in {:.2f}s.".format(
+            deck.get_size(), num_images, elapsed
+        )
+    )
+    peak_rss = _get_peak_rss(
+        int(h.dont_require(params.config, "output/render_workers") or 1) > 1
+    )
+    for name, peak in peak_rss or []:
+        print("Peak RSS of {}: {:.1f} MiB".format(name, peak))
+    fit_stats = EmbeddedImageTextCardLayer.get_fit_stats()
+    print(
+        "Text fitting: {} texts, {} layout passes ({} when trying every size)".format(
+            fit_stats.fits,
+            fit_stats.layout_passes,
+            fit_stats.linear_layout_passes,
+        )
+    )
+    print("Text layout cache: " + str(TextLayoutCache.stats()))
+    if args.encodings:
+        for (name, _), (seconds, size) in zip(_ENCODINGS, encode_totals):
+            print("Encoding {}: {:.2f}s, {:.1f} KiB".format(name, seconds, size / 1024))
+    if input_provider.TYPE == InputProviderType.GOOGLE:
+        print(
+            "Google drive: {} service objects built, {} connections opened".format(
+                GoogleDriveClient.get_build_count(), _connections
+            )
+        )
+    if args.max_rss_mib is not None:
+        if peak_rss is None:
+            print("Warning: peak RSS can't be measured on this platform")
+        for name, peak in peak_rss or []:
+            if peak > args.max_rss_mib:
+                raise Exception(
+                    "Peak RSS of {} was {:.1f} MiB, over the limit of {} MiB".format(
+                        name, peak, args.max_rss_mib
+                    )
+                )
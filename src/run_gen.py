@@ -1,63 +1,67 @@
 #!/usr/bin/python
 import argparse
+import os
 
 from gen.generator import Generator
-from param.config_enums import OutputProviderType
-from param.input_parameters import InputParameterBuilder
-from provider.input_provider import InputProviderFactory
-from provider.output_provider import OutputProviderFactory
+from layer.text_layout_cache import TextLayoutCache
+from param.config_enums import InputProviderType, OutputProviderType
+from param.input_parameters import InputParameterBuilder, InputParameters
+from provider.input_provider import InputProvider, InputProviderFactory
+from provider.output_provider import OutputProvider, OutputProviderFactory
 from tts.tts_helper import TTSHelper
+from util.file_watcher import FileWatcher
+from util.font_cache import FontCache
 from util.helpers import Helpers as h
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--gen_config",
-        type=str,
-        required=True,
-        help="Path to json-formatted generation configuration.",
-    )
-    parser.add_argument(
-        "--deck_config",
-        type=str,
-        required=True,
-        help="Path to json-formatted deck configuration.",
-    )
-    parser.add_argument(
-        "--decklist",
-        type=str,
-        required=True,
-        help="Path or name of the decklist to generate.",
-    )
-    parser.add_argument(
-        "--tts", action="store_true", help="Flag to build and save a TTS deck object."
-    )
-    args = parser.parse_args()
 
+def _build_params(args: argparse.Namespace) -> InputParameters:
     params = InputParameterBuilder.build(
         args.gen_config, args.deck_config, args.decklist
     )
-    input_provider = InputProviderFactory.build(params.config)
-    output_provider = OutputProviderFactory.build(params.config)
+    if args.workers is not None:
+        params.config.setdefault("output", {})["render_workers"] = args.workers
+    if args.cache_dir is not None:
+        params.config.setdefault("cache", {})["dir"] = args.cache_dir
+    if args.offline:
+        params.config.setdefault("input", {})["offline"] = True
+    if args.incremental or args.watch:
+        params.config.setdefault("cache", {})["incremental"] = True
+    return params
+
 
+def _generate(
+    args: argparse.Namespace,
+    params: InputParameters,
+    input_provider: InputProvider,
+    output_provider: OutputProvider,
+):
     deck = Generator.gen_deck(params, input_provider)
     (front_files, back_files) = Generator.gen_and_save_images(deck, output_provider)
     print("Saved deck images.")
+    if deck.needs_digests():
+        (rendered, reused) = deck.get_render_counts()
+        print("Rendered {} cards, reused {} unchanged cards.".format(rendered, reused))
+        print("Tile store: " + str(deck.get_tile_store_stats()))
+    print("Image cache: " + str(input_provider.get_image_cache_stats()))
+    print("Fitted image cache: " + str(input_provider.get_fitted_image_cache_stats()))
+    print("Font cache: " + str(FontCache.stats()))
+    for font_file, sizes in FontCache.get_sizes().items():
+        print("  " + font_file + ": sizes " + ", ".join(map(str, sizes)))
+    print("Text layout cache: " + str(TextLayoutCache.stats()))
 
     if args.tts:
         if (
-            len(front_files) != 1
+            not front_files
             or not back_files
             or output_provider.TYPE != OutputProviderType.GOOGLE
         ):
             raise Exception(
-                "Expected a single output image (sheet), a back image, and google drive output to generate TTS object."
+                "Expected output images (sheets), a back image, and google drive output to generate TTS object."
             )
 
         tts_deck = TTSHelper.build_deck(
-            deck.get_size(),
-            deck.get_dimensions()[0],
-            front_files[0],
+            [(sheet.size, sheet.width, sheet.height) for sheet in deck.get_sheets()],
+            front_files,
             back_files,
         )
         tts_object_name = deck.get_name() + "_tts.json"
@@ -78,3 +82,119 @@ if __name__ == "__main__":
                 + TTSHelper.TTS_SAVED_OBJECTS_FOLDER
                 + "' must exist."
             )
+
+    if output_provider.TYPE == OutputProviderType.GOOGLE:
+        print("Drive uploads: " + str(output_provider.get_upload_stats()))
+
+
+# regenerates the deck whenever the configs, the decklist or the input assets
+# change. the input provider's caches stay warm between runs, and the
+# incremental build only renders the cards whose digests changed: cards using
+# a changed asset, cards of a changed card type, and changed decklist rows.
+def _watch(args: argparse.Namespace, params: InputParameters):
+    if h.dont_require(params.config, "input/type") not in [
+        None,
+        InputProviderType.LOCAL,
+    ]:
+        raise Exception("--watch requires local input.")
+
+    input_provider = InputProviderFactory.build(params.config)
+    output_provider = OutputProviderFactory.build(params.config)
+    input_folder = os.path.abspath(h.require(params.config, "input/folder"))
+    watcher = FileWatcher([args.gen_config, args.deck_config, input_folder])
+    while True:
+        try:
+            _generate(args, params, input_provider, output_provider)
+        except Exception as e:
+            print("Error: " + str(e))
+
+        print("Watching for changes...")
+        changed = watcher.wait_for_changes(args.watch_interval)
+        print("Changed: " + ", ".join(changed))
+
+        try:
+            new_params = _build_params(args)
+        except Exception as e:
+            print("Error: " + str(e))
+            continue
+        if new_params.config.get("input") != params.config.get("input"):
+            input_provider = InputProviderFactory.build(new_params.config)
+            input_folder = os.path.abspath(h.require(new_params.config, "input/folder"))
+            watcher = FileWatcher([args.gen_config, args.deck_config, input_folder])
+        else:
+            for file in changed:
+                if file.startswith(input_folder + os.sep):
+                    input_provider.invalidate_image(os.path.relpath(file, input_folder))
+        if new_params.config.get("output") != params.config.get("output"):
+            output_provider = OutputProviderFactory.build(new_params.config)
+        params = new_params
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--gen_config",
+        type=str,
+        required=True,
+        help="Path to json-formatted generation configuration.",
+    )
+    parser.add_argument(
+        "--deck_config",
+        type=str,
+        required=True,
+        help="Path to json-formatted deck configuration.",
+    )
+    parser.add_argument(
+        "--decklist",
+        type=str,
+        required=True,
+        help="Path or name of the decklist to generate.",
+    )
+    parser.add_argument(
+        "--tts", action="store_true", help="Flag to build and save a TTS deck object."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-render the cards that changed since the last run, like cache/incremental.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        required=False,
+        help="Folder of rendered cards to reuse, which decks can share, overriding cache/dir.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Read google input from the download cache in input/temp_folder without contacting drive, like input/offline.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and regenerate the deck, incrementally, whenever the configs, decklist or input assets change.",
+    )
+    parser.add_argument(
+        "--watch_interval",
+        type=float,
+        default=1.0,
+        help="Seconds between checks for changes in --watch mode.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        help="Number of processes rendering cards, overriding output/render_workers.",
+    )
+    args = parser.parse_args()
+
+    params = _build_params(args)
+    if args.watch:
+        _watch(args, params)
+    else:
+        _generate(
+            args,
+            params,
+            InputProviderFactory.build(params.config),
+            OutputProviderFactory.build(params.config),
+        )
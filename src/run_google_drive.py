@@ -1,8 +1,8 @@
 #!/usr/bin/python
 import argparse
 from enum import StrEnum
-import os
 
+from google.drive_transfers import DriveTransfers
 from google.google_drive_client import GoogleDriveClient
 
 # TODO upload csv
@@ -43,6 +43,12 @@ if __name__ == "__main__":
         type=str,
         default="../credentials.json",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DriveTransfers.DEFAULT_CONCURRENCY,
+        help="Number of files transferred at once by the folder actions.",
+    )
     args = parser.parse_args()
 
     if not args.creds_file:
@@ -57,21 +63,23 @@ if __name__ == "__main__":
         if not args.source or not args.target_folder:
             raise Exception("--source and --target_folder required.")
         client.create_or_update_png(args.source, args.target_folder, args.name)
+        print("Drive uploads: " + str(client.get_upload_stats()))
     elif args.action == Actions.DOWNLOAD_FOLDER:
         if not args.source_folder or not args.target_folder:
             raise Exception("--source_folder and --target_folder required.")
-        client.download_folder(args.source_folder, args.target_folder)
+        result = client.download_folder(
+            args.source_folder, args.target_folder, args.concurrency
+        )
+        if len(result.failed) > 0:
+            raise Exception(str(len(result.failed)) + " files failed to download.")
     elif args.action == Actions.UPLOAD_FOLDER:
         if not args.source_folder or not args.target_folder:
             raise Exception("--source_folder and --target_folder required.")
-        for f in os.listdir(args.source_folder):
-            if f.endswith(".png"):
-                client.create_or_update_png(
-                    os.path.join(args.source_folder, f), args.target_folder
-                )
-            elif f.endswith(".json"):
-                client.create_or_update_json(
-                    os.path.join(args.source_folder, f), args.target_folder
-                )
+        result = client.upload_folder(
+            args.source_folder, args.target_folder, args.concurrency
+        )
+        print("Drive uploads: " + str(client.get_upload_stats()))
+        if len(result.failed) > 0:
+            raise Exception(str(len(result.failed)) + " files failed to upload.")
     else:
         raise Exception("Unsupported action: " + args.action)
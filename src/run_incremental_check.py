@@ -0,0 +1,119 @@
+#!/usr/bin/python
+import argparse
+import copy
+import os
+import tempfile
+
+from PIL import Image as PILImage
+
+from card.card_builder import CardBuilder
+from deck.deck_builder import DeckBuilder
+from gen.generator import Generator
+from param.input_parameters import InputParameterBuilder
+from provider.input_provider import InputProviderFactory
+from provider.output_provider import OutputProviderFactory
+
+# cards per row of a sheet, so that its last row can be partly filled
+_SHEET_MAX_WIDTH = 2
+
+
+# builds a deck of the first rows of the decklist, one card each, into the
+# folder and returns the saved front images
+def _build(
+    config: dict, rows: list[dict], num_cards: int, folder: str, incremental: bool
+) -> list[str]:
+    config = copy.deepcopy(config)
+    config.setdefault("output", {}).update(
+        {
+            "type": "local",
+            "folder": folder,
+            "image_layout": "sheet",
+            "sheet_max_width": _SHEET_MAX_WIDTH,
+            "sheet_max_height": None,
+            "sheet_max_pixels": None,
+        }
+    )
+    config.setdefault("output", {}).pop("encoding", None)
+    config.setdefault("cache", {}).update({"incremental": incremental, "dir": None})
+    input_provider = InputProviderFactory.build(config)
+    deck = DeckBuilder(CardBuilder(config, input_provider), config).build(
+        "check", [rows[i] | {"count": "1"} for i in range(num_cards)]
+    )
+    (front_files, _) = Generator.gen_and_save_images(
+        deck, OutputProviderFactory.build(config)
+    )
+    return front_files
+
+
+# raises if the images of the incremental build differ from the full build's
+def _compare(step: str, incremental_files: list[str], full_files: list[str]):
+    if len(incremental_files) != len(full_files):
+        raise Exception(
+            "{}: {} images, expected {}".format(
+                step, len(incremental_files), len(full_files)
+            )
+        )
+    for incremental_file, full_file in zip(incremental_files, full_files):
+        with PILImage.open(incremental_file) as incremental, PILImage.open(
+            full_file
+        ) as full:
+            if incremental.size != full.size:
+                raise Exception(
+                    "{}: '{}' is {}, expected {}".format(
+                        step, incremental_file, incremental.size, full.size
+                    )
+                )
+            if incremental.tobytes() != full.tobytes():
+                raise Exception(
+                    "{}: '{}' differs from a full build".format(step, incremental_file)
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks that incremental builds match full builds when cards are added to or removed from a sheet."
+    )
+    parser.add_argument(
+        "--gen_config",
+        type=str,
+        required=True,
+        help="Path to json-formatted generation configuration.",
+    )
+    parser.add_argument(
+        "--deck_config",
+        type=str,
+        required=True,
+        help="Path to json-formatted deck configuration.",
+    )
+    parser.add_argument(
+        "--decklist",
+        type=str,
+        required=True,
+        help="Path or name of a decklist with at least 4 cards.",
+    )
+    args = parser.parse_args()
+
+    params = InputParameterBuilder.build(
+        args.gen_config, args.deck_config, args.decklist
+    )
+    rows = [
+        row
+        for row in InputProviderFactory.build(params.config).get_decklist(
+            params.decklist
+        )
+        if not bool(row.get("skip"))
+    ]
+    if len(rows) < 4:
+        raise Exception("Expected a decklist with at least 4 rows.")
+
+    with tempfile.TemporaryDirectory() as temp:
+        incremental_folder = os.path.join(temp, "incremental")
+        # a card added to the partly filled row, then removed again
+        for step, num_cards in [("first build", 3), ("3 to 4", 4), ("4 to 3", 3)]:
+            full_folder = os.path.join(temp, "full_" + str(num_cards))
+            full_files = _build(params.config, rows, num_cards, full_folder, False)
+            incremental_files = _build(
+                params.config, rows, num_cards, incremental_folder, True
+            )
+            _compare(step, incremental_files, full_files)
+            print("{}: matches a full build.".format(step))
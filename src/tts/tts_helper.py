@@ -2,7 +2,6 @@
 import json
 import os
 from abc import ABC
-from math import ceil
 
 
 class TTSHelper(ABC):
@@ -16,29 +15,44 @@ class TTSHelper(ABC):
     )
     _DECK_KEY = 41  # TODO understand what the keys in "CustomDeck are"
 
-    # returns the dict representation of the TTS deck saved object file
+    # returns the dict representation of the TTS deck saved object file, with
+    # a custom deck per sheet; sheets are (number of cards, cards wide, cards
+    # high) in deck order, matching the front ids
     @staticmethod
-    def build_deck(deck_size: int, max_width: int, front_id: str, back_id: str) -> dict:
+    def build_deck(
+        sheets: list[tuple[int, int, int]], front_ids: list[str], back_id: str
+    ) -> dict:
+        if len(sheets) != len(front_ids):
+            raise Exception(
+                "Expected a front image per sheet, got "
+                + str(len(front_ids))
+                + " images for "
+                + str(len(sheets))
+                + " sheets."
+            )
+
         with open(TTSHelper._TEMPLATE_FILE) as template:
             deck_object = json.load(template)
 
-        deck_object["ObjectStates"][0]["DeckIDs"] = [
-            TTSHelper._DECK_KEY * 100 + i for i in range(deck_size)
-        ]
-
-        num_wide = min(max_width, deck_size)
-        deck_object["ObjectStates"][0]["CustomDeck"] = {
-            str(TTSHelper._DECK_KEY): {
+        deck_ids = []
+        custom_deck = {}
+        for i, ((num_cards, num_wide, num_high), front_id) in enumerate(
+            zip(sheets, front_ids)
+        ):
+            key = TTSHelper._DECK_KEY + i
+            deck_ids.extend(key * 100 + j for j in range(num_cards))
+            custom_deck[str(key)] = {
                 "FaceURL": TTSHelper._GOOGLE_DOWNLOAD_URL_FORMAT.format(front_id),
                 "BackURL": TTSHelper._GOOGLE_DOWNLOAD_URL_FORMAT.format(back_id),
                 "NumWidth": num_wide,
-                "NumHeight": ceil(deck_size / num_wide),
+                "NumHeight": num_high,
                 "BackIsHidden": True,
                 "UniqueBack": False,
                 "Type": 0,
             }
-        }
 
+        deck_object["ObjectStates"][0]["DeckIDs"] = deck_ids
+        deck_object["ObjectStates"][0]["CustomDeck"] = custom_deck
         return deck_object
 
     @staticmethod
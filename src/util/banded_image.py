@@ -0,0 +1,50 @@
+#!/usr/bin/python
+import threading
+from typing import Iterator
+
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+
+# an image produced as bands of rows from top to bottom, e.g. a sheet
+# rendered one row of cards at a time, so it can be encoded without holding
+# all of it in memory. the bands are produced as they are read, which can
+# only be done once, and each band is closed when the next is requested.
+class BandedImage:
+    def __init__(self, mode: str, size: tuple[int, int], bands: Iterator[Image]):
+        self.mode = mode
+        self.size = size
+        self._bands = bands
+        self._done = threading.Event()
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def get_bands(self) -> Iterator[Image]:
+        try:
+            yield from self._bands
+        finally:
+            self._done.set()
+
+    # the whole image, which the caller owns
+    def to_image(self) -> Image:
+        image = PILImage.new(self.mode, self.size)
+        y = 0
+        for band in self.get_bands():
+            image.paste(band, (0, y))
+            y = y + band.height
+        return image
+
+    # stops producing the bands, if they were not all read
+    def close(self):
+        self._bands.close()
+        self._done.set()
+
+    # waits until the bands are all read, or the image is closed
+    def wait(self):
+        self._done.wait()
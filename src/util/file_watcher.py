@@ -0,0 +1,45 @@
+#!/usr/bin/python
+import os
+import time
+
+
+# polls files, and every file under folders, for changes to their
+# modification time or size
+class FileWatcher:
+    def __init__(self, paths: list[str]):
+        self._paths = [os.path.abspath(p) for p in paths]
+        self._states = self._get_states()
+
+    # blocks until a file is added, removed or modified and returns the
+    # changed files
+    def wait_for_changes(self, interval: float) -> list[str]:
+        while True:
+            time.sleep(interval)
+            states = self._get_states()
+            changed = [
+                file
+                for file in states.keys() | self._states.keys()
+                if states.get(file) != self._states.get(file)
+            ]
+            self._states = states
+            if len(changed) > 0:
+                return sorted(changed)
+
+    def _get_states(self) -> dict[str, tuple[int, int]]:
+        states = {}
+        for path in self._paths:
+            if os.path.isdir(path):
+                for folder, _, files in os.walk(path):
+                    for file in files:
+                        self._add_state(states, os.path.join(folder, file))
+            else:
+                self._add_state(states, path)
+        return states
+
+    def _add_state(self, states: dict[str, tuple[int, int]], file: str):
+        try:
+            stat = os.stat(file)
+        except OSError:
+            # removed while listing
+            return
+        states[file] = (stat.st_mtime_ns, stat.st_size)
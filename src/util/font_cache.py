@@ -0,0 +1,90 @@
+#!/usr/bin/python
+import hashlib
+import io
+import threading
+from abc import ABC
+from typing import Optional
+
+from PIL import ImageFont
+
+from util.lru_cache import CacheStats
+
+
+# process-wide cache of fonts; each font file is read once and every size is
+# loaded from the bytes in memory
+class FontCache(ABC):
+    _lock = threading.Lock()
+    _font_bytes: dict[str, Optional[bytes]] = {}
+    _digests: dict[str, str] = {}
+    _fonts: dict[tuple[str, int, Optional[int]], ImageFont.FreeTypeFont] = {}
+    _stats = CacheStats()
+
+    @staticmethod
+    def get(
+        font_file: str, size: int, layout_engine: Optional[int] = None
+    ) -> ImageFont.FreeTypeFont:
+        key = (font_file, size, layout_engine)
+        with FontCache._lock:
+            font = FontCache._fonts.get(key)
+            if font is not None:
+                FontCache._stats.hits = FontCache._stats.hits + 1
+                return font
+            FontCache._stats.misses = FontCache._stats.misses + 1
+
+            font_bytes = FontCache._get_font_bytes(font_file)
+            font = ImageFont.truetype(
+                # fall back to the file name so pillow can search the system
+                # font folders as usual
+                io.BytesIO(font_bytes) if font_bytes is not None else font_file,
+                size,
+                layout_engine=layout_engine,
+            )
+            FontCache._fonts[key] = font
+            FontCache._stats.entries = len(FontCache._fonts)
+            return font
+
+    # returns a digest of the font file's contents, or of its name when pillow
+    # resolves it from the system font folders
+    @staticmethod
+    def get_digest(font_file: str) -> str:
+        with FontCache._lock:
+            digest = FontCache._digests.get(font_file)
+            if digest is None:
+                font_bytes = FontCache._get_font_bytes(font_file)
+                digest = hashlib.sha1(
+                    font_bytes if font_bytes is not None else font_file.encode()
+                ).hexdigest()
+                FontCache._digests[font_file] = digest
+            return digest
+
+    @staticmethod
+    def stats() -> CacheStats:
+        with FontCache._lock:
+            return CacheStats(**vars(FontCache._stats))
+
+    # returns the sizes loaded so far for each font file
+    @staticmethod
+    def get_sizes() -> dict[str, list[int]]:
+        with FontCache._lock:
+            sizes: dict[str, set[int]] = {}
+            for font_file, size, _ in FontCache._fonts.keys():
+                sizes.setdefault(font_file, set()).add(size)
+            return {f: sorted(s) for f, s in sizes.items()}
+
+    @staticmethod
+    def _get_font_bytes(font_file: str) -> Optional[bytes]:
+        if font_file not in FontCache._font_bytes:
+            try:
+                with open(font_file, "rb") as f:
+                    FontCache._font_bytes[font_file] = f.read()
+            except OSError:
+                FontCache._font_bytes[font_file] = None
+            FontCache._update_size()
+        return FontCache._font_bytes[font_file]
+
+    @staticmethod
+    def _update_size():
+        FontCache._stats.entries = len(FontCache._fonts)
+        FontCache._stats.size_bytes = sum(
+            len(b) for b in FontCache._font_bytes.values() if b is not None
+        )
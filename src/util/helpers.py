@@ -1,5 +1,7 @@
 #!/usr/bin/python
+import os
 from abc import ABC
+from typing import Optional
 
 
 class Helpers(ABC):
@@ -28,3 +30,12 @@ class Helpers(ABC):
             if v is None:
                 break
         return v
+
+    # modification time and size, or None if there is no file
+    @staticmethod
+    def get_file_state(file: str) -> Optional[list[int]]:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
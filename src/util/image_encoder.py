@@ -0,0 +1,111 @@
+#!/usr/bin/python
+import contextlib
+from typing import BinaryIO
+
+from PIL.Image import Image
+
+from param.config_enums import ImageFormat, OutputProviderType
+from util.banded_image import BandedImage
+from util.helpers import Helpers as h
+from util.png_writer import PngWriter
+
+
+# encodes the output images as configured by output/encoding, whose settings
+# may be overridden for an output type by a nested block of that name, e.g.
+# output/encoding/google:
+#   format: png (default), webp or jpeg
+#   compress_level: png zlib level, 0 (none) to 9 (smallest)
+#   opaque_to_rgb: save RGBA images without transparent pixels as RGB
+#   quantize_colors: reduce png images to a palette of this many colors
+#   quality: webp and jpeg quality, 1 to 100
+#   lossless: encode webp losslessly
+#   workers: threads compressing bands of each png in parallel (default 1,
+#     which leaves the encoding of whole images to pillow)
+# banded images are written as png band by band, even with a single worker,
+# so new sheets are not encoded by pillow; other settings need the whole
+# image.
+class ImageEncoder:
+    _EXTENSIONS = {
+        ImageFormat.PNG: "png",
+        ImageFormat.WEBP: "webp",
+        ImageFormat.JPEG: "jpg",
+    }
+
+    def __init__(self, encoding: dict):
+        self._format = ImageFormat(encoding.get("format") or ImageFormat.PNG)
+        compress_level = encoding.get("compress_level")
+        self._compress_level = None if compress_level is None else int(compress_level)
+        self._opaque_to_rgb = bool(encoding.get("opaque_to_rgb"))
+        self._quantize_colors = encoding.get("quantize_colors")
+        self._quality = encoding.get("quality")
+        self._lossless = bool(encoding.get("lossless"))
+        self._workers = int(encoding.get("workers") or 1)
+        if self._quantize_colors is not None and self._format != ImageFormat.PNG:
+            raise Exception("output/encoding/quantize_colors requires png format")
+
+    @staticmethod
+    def build(config: dict) -> "ImageEncoder":
+        encoding = h.dont_require(config, "output/encoding") or {}
+        output_type = h.dont_require(config, "output/type") or OutputProviderType.LOCAL
+        return ImageEncoder(
+            {
+                key: value
+                for (key, value) in encoding.items()
+                if key not in list(OutputProviderType)
+            }
+            | (encoding.get(output_type) or {})
+        )
+
+    def get_extension(self) -> str:
+        return ImageEncoder._EXTENSIONS[self._format]
+
+    def get_mime_type(self) -> str:
+        return "image/" + self._format.value
+
+    # whether decoding gives back the RGBA pixels that were encoded
+    def is_lossless(self) -> bool:
+        if self._format == ImageFormat.PNG:
+            return self._quantize_colors is None
+        return self._format == ImageFormat.WEBP and self._lossless
+
+    def save(self, img: Image | BandedImage, fp: str | BinaryIO):
+        if isinstance(img, BandedImage):
+            if (
+                self._format == ImageFormat.PNG
+                and self._quantize_colors is None
+                and not self._opaque_to_rgb
+                and PngWriter.supports(img)
+            ):
+                PngWriter(self._workers, self._compress_level).write(img, fp)
+            else:
+                with contextlib.closing(img.to_image()) as whole:
+                    self.save(whole, fp)
+            return
+
+        if self._format == ImageFormat.JPEG or (
+            self._opaque_to_rgb and _is_opaque(img)
+        ):
+            img = img.convert("RGB")
+        if self._quantize_colors is not None:
+            img = img.quantize(int(self._quantize_colors))
+        elif (
+            self._format == ImageFormat.PNG
+            and self._workers > 1
+            and PngWriter.supports(img)
+        ):
+            PngWriter(self._workers, self._compress_level).write(img, fp)
+            return
+
+        options = {}
+        if self._format == ImageFormat.PNG:
+            if self._compress_level is not None:
+                options["compress_level"] = self._compress_level
+        elif self._quality is not None:
+            options["quality"] = int(self._quality)
+        if self._format == ImageFormat.WEBP:
+            options["lossless"] = self._lossless
+        img.save(fp, format=self._format.value, **options)
+
+
+def _is_opaque(img: Image) -> bool:
+    return img.mode == "RGBA" and img.getchannel("A").getextrema() == (255, 255)
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+    def __str__(self) -> str:
+        return "{} hits, {} misses, {} evictions, {} entries ({} bytes)".format(
+            self.hits, self.misses, self.evictions, self.entries, self.size_bytes
+        )
+
+
+# least-recently-used cache bounded by the total size (in bytes) of its entries
+class LRUCache:
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses = self._stats.misses + 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits = self._stats.hits + 1
+            return entry[0]
+
+    # entries larger than the whole budget are not cached
+    def put(self, key: Hashable, value: Any, size: int):
+        with self._lock:
+            self._remove(key)
+            if size <= self._max_bytes:
+                self._entries[key] = (value, size)
+                self._stats.size_bytes = self._stats.size_bytes + size
+                while self._stats.size_bytes > self._max_bytes:
+                    evicted = next(iter(self._entries))
+                    self._remove(evicted)
+                    self._stats.evictions = self._stats.evictions + 1
+            self._stats.entries = len(self._entries)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+            self._stats.entries = len(self._entries)
+
+    def invalidate_matching(self, matches: Callable[[Hashable], bool]):
+        with self._lock:
+            for key in [k for k in self._entries.keys() if matches(k)]:
+                self._remove(key)
+            self._stats.entries = len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.size_bytes = 0
+            self._stats.entries = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**vars(self._stats))
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._stats.size_bytes = self._stats.size_bytes - entry[1]
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator, Optional
+
+from PIL import ImageChops
+from PIL.Image import Image
+
+from util.banded_image import BandedImage
+
+
+# writes large png images by compressing bands of rows in parallel threads,
+# which zlib allows since it releases the GIL. every row uses the Up filter,
+# so a band only needs the row above it, and each band is a raw deflate
+# stream primed with the end of the band above and ended by a sync flush (the
+# last band by a finish), so the bands concatenate into a single zlib stream,
+# as pigz does. a banded image is written as its bands are produced, holding
+# only a few of them.
+class PngWriter:
+    # PNG colour type of each mode
+    _COLOR_TYPES = {"L": 0, "RGB": 2, "LA": 4, "RGBA": 6}
+    # raw bytes of the rows compressed together
+    _BAND_BYTES = 4 * 1024 * 1024
+    # deflate's window; the dictionary a band is primed with
+    _WINDOW_BYTES = 32 * 1024
+    _DEFAULT_COMPRESS_LEVEL = 6
+    _UP_FILTER = b"\x02"
+
+    def __init__(self, workers: int, compress_level: int | None = None):
+        self._workers = workers
+        self._compress_level = (
+            PngWriter._DEFAULT_COMPRESS_LEVEL
+            if compress_level is None
+            else compress_level
+        )
+
+    @staticmethod
+    def supports(img: Image | BandedImage) -> bool:
+        return img.mode in PngWriter._COLOR_TYPES
+
+    def write(self, img: Image | BandedImage, fp: str | BinaryIO):
+        if not PngWriter.supports(img):
+            raise Exception("Unsupported png writer image mode " + img.mode)
+        if isinstance(fp, str):
+            with open(fp, "wb") as f:
+                self._write(img, f)
+        else:
+            self._write(img, fp)
+
+    def _write(self, img: Image | BandedImage, f: BinaryIO):
+        (w, h) = img.size
+        f.write(b"\x89PNG\r\n\x1a\n")
+        _write_chunk(
+            f,
+            b"IHDR",
+            struct.pack(">IIBBBBB", w, h, 8, PngWriter._COLOR_TYPES[img.mode], 0, 0, 0),
+        )
+        _write_chunk(f, b"IDAT", _get_zlib_header(self._compress_level))
+        adler = zlib.adler32(b"")
+        zdict = None
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            # bands are filtered here and compressed on the threads, a few
+            # ahead of the one written; the checksum of the uncompressed
+            # stream has to run through them in order
+            pending = deque()
+            for data, last in self._filter_bands(
+                img.get_bands() if isinstance(img, BandedImage) else iter([img]), h
+            ):
+                adler = zlib.adler32(data, adler)
+                pending.append(pool.submit(self._compress_band, data, zdict, last))
+                zdict = data[-PngWriter._WINDOW_BYTES :]
+                if len(pending) >= 2 * self._workers:
+                    _write_chunk(f, b"IDAT", pending.popleft().result())
+            while len(pending) > 0:
+                _write_chunk(f, b"IDAT", pending.popleft().result())
+        _write_chunk(f, b"IDAT", struct.pack(">I", adler))
+        _write_chunk(f, b"IEND", b"")
+
+    # splits the images, bands of the image from top to bottom, into bands
+    # of at most _BAND_BYTES of rows and returns the filtered rows of each
+    # and whether it is the last
+    def _filter_bands(
+        self, images: Iterator[Image], h: int
+    ) -> Iterator[tuple[bytes, bool]]:
+        top = 0
+        above = None
+        for image in images:
+            row_bytes = image.width * len(image.getbands())
+            band_rows = max(1, PngWriter._BAND_BYTES // max(1, row_bytes))
+            for y in range(0, image.height, band_rows):
+                bottom = min(image.height, y + band_rows)
+                data = self._filter_rows(image, (y, bottom), above)
+                yield (data, top + bottom == h)
+            top = top + image.height
+            above = image.crop((0, image.height - 1, image.width, image.height))
+
+    # returns the band's compressed stream, primed with the tail of the band
+    # above, filtered the same way
+    def _compress_band(self, data: bytes, zdict: Optional[bytes], last: bool) -> bytes:
+        options = {}
+        if zdict is not None:
+            options["zdict"] = zdict
+        compressor = zlib.compressobj(
+            self._compress_level, zlib.DEFLATED, -zlib.MAX_WBITS, **options
+        )
+        return compressor.compress(data) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        )
+
+    # the rows from top to bottom (exclusive), each Up filtered: the
+    # difference from the row above, which is above for the first row of the
+    # image, or zeros without it
+    def _filter_rows(
+        self, img: Image, rows: tuple[int, int], above: Optional[Image]
+    ) -> bytes:
+        (top, bottom) = rows
+        w = img.width
+        with img.crop((0, top, w, bottom)) as band, img.crop(
+            (0, top - 1, w, bottom - 1)
+        ) as shifted:
+            if top == 0 and above is not None:
+                shifted.paste(above, (0, 0))
+            with ImageChops.subtract_modulo(band, shifted) as filtered:
+                filtered_bytes = filtered.tobytes()
+        row_bytes = len(filtered_bytes) // (bottom - top)
+        return b"".join(
+            PngWriter._UP_FILTER + filtered_bytes[i : i + row_bytes]
+            for i in range(0, len(filtered_bytes), row_bytes)
+        )
+
+
+def _write_chunk(f: BinaryIO, chunk_type: bytes, data: bytes):
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+# CMF (deflate, 32K window) and FLG, whose level bits are only informative
+def _get_zlib_header(compress_level: int) -> bytes:
+    if compress_level < 2:
+        return b"\x78\x01"
+    if compress_level < 6:
+        return b"\x78\x5e"
+    if compress_level == 6:
+        return b"\x78\x9c"
+    return b"\x78\xda"